@@ -0,0 +1,23 @@
+import sys, io, contextlib
+import os.path
+import glob
+import pytest
+
+# the tests import ventos from the repository root (not from inside ventos,
+# where ventos/signal.py would shadow the standard library signal module)
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+if root not in sys.path:
+    sys.path.insert(0, root)
+
+fixtures = sorted(glob.glob(os.path.join(root, 'test_traces', '*.pirds.json')))
+
+@pytest.fixture(scope='session')
+def traces():
+    from ventos import pirds
+    return {os.path.basename(f).split('_')[0]: pirds.read(f) for f in fixtures}
+
+# function(*args, **kwargs) with its printing (eg the simulator's event
+# reports) discarded
+def quietly(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
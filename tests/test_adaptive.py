@@ -0,0 +1,23 @@
+import numpy as np
+from ventos import instrument
+from ventos.test_trace import scenarios
+from ventos.sim import simple
+from conftest import quietly
+
+def run(s):
+    return quietly(simple.execute_scenario, s)
+
+# the adaptive integrator reports on the same grid as the fixed step loop, and
+# converges to it as the fixed step shrinks
+def test_adaptive_matches_fine_euler():
+    s = dict(scenarios()['Creeping'], end_time=30)
+    adaptive = run(dict(s, integrator='adaptive'))
+    euler = run(dict(s, time_resolution=1)).iloc[::s['time_resolution']].reset_index(drop=True)
+    assert np.array_equal(adaptive['time'], euler['time'])
+    assert np.abs(adaptive['lung_volume'] - euler['lung_volume']).max() < 5 # ml
+    assert np.abs(adaptive['pressure_alveolus'] - euler['pressure_alveolus']).max() < 0.1 # cmH2O
+
+def test_adaptive_records_stages():
+    stats = instrument.Stats()
+    quietly(simple.execute_scenario, dict(scenarios()['Creeping'], end_time=30, integrator='adaptive'), stats=stats)
+    assert {'execute_scenario.loop', 'adaptive.segment', 'loop.dataframe'} <= set(stats.stages)
@@ -0,0 +1,35 @@
+import copy
+from ventos.test_trace import scenarios, base_scenario
+from ventos.sim import simple, batch
+from conftest import quietly
+
+# every badness (shortened) plus event timelines out of order, targeting the
+# patient, past the end and changing every step
+def test_batch_matches_execute_scenario():
+    sc = {title: dict(s, end_time=min(s['end_time'], 60)) for title, s in scenarios().items()}
+    sc['shuffled'] = dict(sc['Creeping'], events=list(reversed(sc['Creeping']['events'])))
+    sc['patient'] = dict(base_scenario, end_time=60, events=[
+        dict(attr='resistance', val=60, time=10), dict(attr='compliance', val='Lung', time=20),
+        dict(attr='compliance', val='Total', time=20), dict(attr='Pi', val=20, time=20),
+        dict(attr='rate', val=20, time=20.01)])
+    sc['lungcurve'] = dict(base_scenario, end_time=20, compliance='Lung', events=[
+        dict(attr='resistance', val=5, time=3, target='patient'), dict(attr='late', val=1, time=99)])
+    sc['ramp'] = dict(base_scenario, end_time=60, events=[dict(attr='Pi', val=15 + i % 5, time=i / 10) for i in range(600)])
+    before = copy.deepcopy(sc)
+    results = quietly(batch.execute_scenarios, sc)
+    for title, s in sc.items():
+        assert quietly(simple.execute_scenario, s).equals(results[title]), title
+    assert sc == before
+
+# collapsible airway patients, alone and batched with simple ones, with
+# events on both the patient and the ventilator
+def test_batch_matches_execute_scenario_collapsible():
+    collapsible = dict(base_scenario, patient='collapsible', end_time=60)
+    sc = dict(
+        collapsible=dict(collapsible, title='collapsible', events=[]),
+        breathing=dict(collapsible, title='breathing', Pmus=3, resistance=40, events=[
+            dict(attr='PEEP', val=8, time=10), dict(attr='resistance', val=10, time=25, target='patient')]),
+        simple=dict(base_scenario, end_time=60, events=[dict(attr='Pi', val=20, time=30)]))
+    results = quietly(batch.execute_scenarios, sc)
+    for title, s in sc.items():
+        assert quietly(simple.execute_scenario, s).equals(results[title]), title
@@ -0,0 +1,32 @@
+import pytest
+from ventos import benchmark
+from conftest import quietly
+
+# the frames each stage produces, running every stage repeat times
+def stage_results(repeat):
+    results = {}
+    def measure(stage, samples, run):
+        for _ in range(repeat):
+            results[stage] = run()
+        return results[stage]
+    quietly(benchmark.pipeline, 20, 30, 0, measure)
+    return results
+
+# repeated runs must not change what later stages are measured on
+def test_repeats_do_not_change_the_data():
+    once, thrice = stage_results(1), stage_results(3)
+    assert once['decorate_sim'].equals(thrice['decorate_sim'])
+    assert once['df_to_PIRDS'].equals(thrice['df_to_PIRDS'])
+    assert once['process_trace'].equals(thrice['process_trace'])
+
+def test_benchmark_reports_every_stage():
+    results = benchmark.benchmark(20, 5, memory=False, repeat=1)
+    assert [r['stage'] for r in results] == ['lung.scalar', 'lung.vectorized', 'loop', 'decorate_sim',
+                                             'df_to_PIRDS', 'process_trace']
+
+# no entry point loads pandas, matplotlib or the other heavy modules on
+# import (the time budgets are left to benchmark.py --imports)
+@pytest.mark.parametrize('module', list(benchmark.import_budgets))
+def test_entry_points_import_no_heavy_modules(module):
+    seconds, loaded = benchmark.import_time(module, repeat=1)
+    assert loaded == []
@@ -0,0 +1,32 @@
+import numpy as np
+from ventos import columnar
+from ventos.test_trace import base_scenario
+from ventos.sim import simple
+from ventos.sim.simple import PIRDS_arrays
+from conftest import quietly
+
+def trace():
+    return quietly(simple.execute_scenario, dict(base_scenario, end_time=30))
+
+# every column and window reads back the PIRDS integers that were written
+def check_round_trip(df, filename, dtype):
+    columnar.write(df, filename)
+    ms, val = PIRDS_arrays(df)
+    data = columnar.load(filename)
+    assert data.dtype == dtype
+    assert np.array_equal(data[0], ms) and np.array_equal(data[1:], val.T)
+    start, end = ms[100], ms[300]
+    window = columnar.load_columns(filename, start, end)
+    assert np.array_equal(window['time'], ms[100:300])
+    for i, name in enumerate(columnar.trace_columns[1:]):
+        assert np.array_equal(window[name], val[100:300, i])
+    assert columnar.load_frame(filename, start, end)['PI'].tolist() == val[100:300, 0].tolist()
+
+def test_round_trip(tmp_path):
+    check_round_trip(trace(), str(tmp_path / 'trace.npy'), np.int32)
+
+# times past int32 (here 30 days in) are kept exactly, not wrapped
+def test_long_traces_are_not_wrapped(tmp_path):
+    df = trace()
+    df['time'] += 30 * 24 * 3600 * 1000
+    check_round_trip(df, str(tmp_path / 'trace.npy'), np.int64)
@@ -0,0 +1,51 @@
+import pandas as pd
+from ventos.test_trace import scenarios, base_scenario
+from ventos.sim import simple
+from ventos.sim.simple import Log, Patient_log, Ventilator_log
+from conftest import quietly
+
+def patient_rows(n):
+    return [Patient_log(i * 50, 5 + i % 7, 3.5, -2.0, 3000.0 + i, 0.1 * i) for i in range(n)]
+
+# to_frame gives what DataFrame.from_records did on the list of records,
+# with integer only columns as int64 and categories decoded
+def test_log_frame_matches_records():
+    rows = patient_rows(100) + [Patient_log(5000, 5.5, 3.5, -2.0, 3100.0, 0.0)] # pressure_mouth turns float
+    log = Log(Patient_log)
+    log.extend(rows)
+    assert log.to_frame().equals(pd.DataFrame.from_records(rows, columns=Patient_log._fields))
+    ventilator_rows = [Ventilator_log(i, 'IE'[i % 2], 10.0, 5) for i in range(10)]
+    log = Log(Ventilator_log, categories=dict(phase=('E', 'I')))
+    log.extend(ventilator_rows)
+    assert log.to_frame().equals(pd.DataFrame.from_records(ventilator_rows, columns=Ventilator_log._fields))
+    assert list(log) == ventilator_rows
+
+def test_log_indexing_and_iteration():
+    rows = patient_rows(1000)
+    log = Log(Patient_log)
+    log.extend(rows)
+    assert len(log) == 1000
+    assert log[0] == rows[0] and log[-1] == rows[-1] and log[10:20:3] == rows[10:20:3]
+    assert list(log) == rows
+    assert type(log[3].time) is int and type(next(iter(log)).time) is int
+    try:
+        log[1000]
+        assert False, 'expected IndexError'
+    except IndexError:
+        pass
+
+# concatenated chunks equal the single frame of loop and execute_scenario
+def test_chunks_equal_whole_run():
+    for s in [scenarios()['Creeping'], dict(base_scenario, title='coll', patient='collapsible', end_time=30, events=[])]:
+        s = dict(s, end_time=min(s['end_time'], 60))
+        p, v = simple.scenario_models(s)
+        whole = quietly(simple.loop, p, v, end_time=s['end_time'] * 1000, time_resolution=s['time_resolution'],
+                        events=s['events'])
+        p, v = simple.scenario_models(s, ventilator_log=False)
+        chunks = quietly(lambda: list(simple.loop_chunks(p, v, end_time=s['end_time'] * 1000,
+                                                         time_resolution=s['time_resolution'],
+                                                         events=s['events'], chunk_size=333)))
+        assert len(chunks) > 1
+        assert pd.concat(chunks, ignore_index=True).equals(whole)
+        decorated = quietly(lambda: pd.concat(simple.execute_scenario_chunks(s, chunk_size=500), ignore_index=True))
+        assert decorated.equals(quietly(simple.execute_scenario, s))
@@ -0,0 +1,42 @@
+import numpy as np
+from ventos import lung
+
+# pressure where the increasing curve reaches v, by bisection
+def root(curve, v, lo, hi):
+    for _ in range(200):
+        mid = (lo + hi) / 2
+        if curve(mid) < v:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2
+
+# volumes (% TLC) inside the -100..200 cmH2O table and beyond both ends
+total_volumes = np.concatenate((np.linspace(lung.total(-100), lung.total(200), 997),
+                                np.linspace(lung.total(-1000), lung.total(-100.5), 50),
+                                np.linspace(lung.total(200.5), lung.total(1000), 50)))
+
+def test_total_inverse():
+    p = lung.total_inverse(total_volumes)
+    assert np.allclose(lung.total_vectorized(p), total_volumes, rtol=0, atol=1e-5)
+    expected = [root(lung.total, v, (v - lung.total_b) / lung.total_f - 8, (v - lung.total_b) / lung.total_f + 8)
+                for v in total_volumes]
+    assert np.abs(p - expected).max() < 1e-5 # cmH2O, the documented interpolation bound
+
+def test_lung_and_chest_inverses():
+    for curve, inverse, volumes, lo, hi in [(lung.lung, lung.lung_inverse, np.linspace(-50, 200, 101), 1e-9, 1e4),
+                                            (lung.chest_wall, lung.chest_wall_inverse, np.linspace(1, 500, 101), -200, 200)]:
+        p = inverse(volumes)
+        assert np.allclose([curve(x) for x in p], volumes, rtol=1e-12, atol=1e-9)
+        assert np.abs(p - [root(curve, v, lo, hi) for v in volumes]).max() < 1e-6
+
+# the array forms give the scalar functions' values element by element
+def test_vectorized_match_scalar():
+    volumes = dict(Total=total_volumes, Lung=np.linspace(-50, 200, 101), Chest=np.linspace(1, 500, 101))
+    pressures = np.linspace(-150, 250, 401)
+    for type, v in volumes.items():
+        assert np.array_equal(lung.pressure_from_volume_vectorized(v, type),
+                              [lung.pressure_from_volume(x, type) for x in v.tolist()])
+        assert np.allclose(lung.volume_from_pressure_vectorized(pressures, type),
+                           [lung.volume_from_pressure(x, type) for x in pressures.tolist()], rtol=1e-12, atol=1e-12)
+    assert isinstance(lung.pressure_from_volume(50.0), float)
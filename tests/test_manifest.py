@@ -0,0 +1,37 @@
+import os, io, contextlib
+from ventos import test_trace
+
+# the files of the build and their modification times
+def built(path):
+    return {name: os.stat(os.path.join(path, name)).st_mtime_ns for name in sorted(os.listdir(path))}
+
+def rebuild(path):
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        test_trace.main(['--path', path, '--workers', '1'])
+    return out.getvalue()
+
+# only scenarios whose hash changed, or whose files are missing, are rebuilt
+def test_only_stale_scenarios_are_rebuilt(tmp_path, monkeypatch):
+    scenarios = test_trace.scenarios
+    monkeypatch.setattr(test_trace, 'scenarios', lambda badnesses: scenarios(badnesses, duration=30))
+    monkeypatch.setattr(test_trace, 'badnesses', dict(Wimpy=test_trace.badnesses['Wimpy'],
+                                                      CrazyFast=test_trace.badnesses['CrazyFast']))
+    path = str(tmp_path)
+    assert '2 of 2 scenarios to rebuild' in rebuild(path)
+    first = built(path)
+    assert set(first) == {'manifest.json', 'Wimpy_20x30.pirds.json', 'Wimpy_20x30.png',
+                          'Crazyfast_20x30.pirds.json', 'Crazyfast_20x30.png'}
+    assert '0 of 2 scenarios to rebuild' in rebuild(path)
+    assert built(path) == first
+    # a changed scenario
+    monkeypatch.setitem(test_trace.badnesses, 'Wimpy', [dict(attr = 'PEEP', val = 8), dict(attr = 'Pi', val = 10)])
+    assert '1 of 2 scenarios to rebuild' in rebuild(path)
+    second = built(path)
+    assert {name for name in first if second[name] != first[name]} == {'manifest.json', 'Wimpy_20x30.pirds.json',
+                                                                        'Wimpy_20x30.png'}
+    # a missing file
+    os.remove(os.path.join(path, 'Crazyfast_20x30.png'))
+    assert '1 of 2 scenarios to rebuild' in rebuild(path)
+    # changed code rebuilds everything
+    monkeypatch.setattr(test_trace, 'code_version', lambda: 'changed')
+    assert '2 of 2 scenarios to rebuild' in rebuild(path)
@@ -0,0 +1,16 @@
+import os, shutil
+from ventos import pirds
+from conftest import fixtures
+
+# a window of the file is the matching rows of the whole file, read by
+# scanning unless the saved index is asked for
+def test_window_reads(tmp_path):
+    filename = str(tmp_path / os.path.basename(fixtures[0]))
+    shutil.copy(fixtures[0], filename)
+    whole = pirds.read(filename)
+    expected = whole[(whole['time'] >= 60000) & (whole['time'] < 120000)].reset_index(drop=True)
+    assert pirds.read(filename, start_ms=60000, end_ms=120000).equals(expected)
+    assert not os.path.exists(pirds.index_filename(filename))
+    assert pirds.read(filename, start_ms=60000, end_ms=120000, index=True).equals(expected)
+    assert os.path.exists(pirds.index_filename(filename))
+    assert pirds.read(filename, start_ms=60000, index=True).equals(whole[whole['time'] >= 60000].reset_index(drop=True))
@@ -0,0 +1,49 @@
+import io
+import pandas as pd
+from ventos.test_trace import scenarios
+from ventos.sim import simple
+from ventos.sim.simple import litres_per_second_to_ml_per_minute
+from conftest import quietly
+
+# the original row by row df_to_PIRDS, the reference the column-wise encoding
+# is checked against
+def df_to_PIRDS_rows(df):
+    pirds = []
+    for index, r in df.iterrows():
+        pirds.append({"event": "M",
+                      "type": "P", "loc":"I",
+                      "ms": int(r.time), "val": int(round(r.pressure_1))})
+        pirds.append({"event": "M",
+                      "type": "P", "loc":"E",
+                      "ms": int(r.time), "val": int(round(r.pressure_2))})
+        pirds.append({"event": "M",
+                      "type": "F", "loc":"I",
+                      "ms": int(r.time), "val": int(round(r.flow_i * litres_per_second_to_ml_per_minute))})
+        pirds.append({"event": "M",
+                      "type": "F", "loc":"E",
+                      "ms": int(r.time), "val": int(round(r.flow_e * litres_per_second_to_ml_per_minute))})
+    return pd.DataFrame.from_records(pirds)
+
+# what update_files wrote with pandas, before write_PIRDS
+def reference(df, format):
+    if format == 'csv':
+        return df_to_PIRDS_rows(df).to_csv(index=False, lineterminator='\n')
+    return df_to_PIRDS_rows(df).to_json(orient='records', lines=True).rstrip('\n') # no final newline
+
+def written(write, *args, **kwargs):
+    handle = io.StringIO()
+    write(*args, handle, **kwargs)
+    return handle.getvalue()
+
+# byte identical to the DataFrame path, whole or in chunks that do not
+# divide the trace evenly
+def test_write_PIRDS_matches_dataframe_path():
+    df = quietly(simple.execute_scenario, dict(scenarios()['Creeping'], end_time=60))
+    pieces = [df.iloc[:100], df.iloc[100:350], df.iloc[350:351], df.iloc[351:]]
+    assert simple.df_to_PIRDS(df).equals(df_to_PIRDS_rows(df))
+    for format in ['json', 'csv']:
+        expected = reference(df, format)
+        for chunk_size in [10000, 7, 333, len(df) - 1]:
+            assert written(simple.write_PIRDS, df, format=format, chunk_size=chunk_size) == expected, (format, chunk_size)
+            assert written(simple.write_PIRDS_chunks, pieces, format=format, chunk_size=chunk_size) == expected, \
+                (format, chunk_size)
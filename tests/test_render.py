@@ -0,0 +1,24 @@
+import os
+from ventos import render, columnar
+from ventos.test_trace import base_scenario
+from ventos.sim import simple
+from conftest import quietly
+
+def test_plot_filename_strips_the_trace_suffix():
+    assert render.plot_filename('dir/Wimpy_20x240.pirds.json') == 'dir/Wimpy_20x240.png'
+    assert render.plot_filename('dir/Wimpy_20x240.trace.npy') == 'dir/Wimpy_20x240.png'
+
+# the .pirds.json and .trace.npy files of a trace give one plot, redrawn
+# only when either is newer than it
+def test_one_plot_per_trace(tmp_path):
+    df = quietly(simple.execute_scenario, dict(base_scenario, end_time=10, events=[]))
+    stem = str(tmp_path / 'Short_20x10')
+    with open(f'{stem}.pirds.json', 'w') as handle:
+        simple.write_PIRDS(df, handle, format='json')
+    columnar.write(df, f'{stem}.trace.npy')
+    assert render.render_directory(str(tmp_path)) == [f'{stem}.png']
+    assert sorted(os.listdir(tmp_path)) == ['Short_20x10.pirds.json', 'Short_20x10.png', 'Short_20x10.trace.npy']
+    assert render.render_directory(str(tmp_path)) == []
+    later = os.path.getmtime(f'{stem}.png') + 10
+    os.utime(f'{stem}.pirds.json', (later, later))
+    assert render.render_directory(str(tmp_path)) == [f'{stem}.png']
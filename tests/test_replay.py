@@ -0,0 +1,8 @@
+import pytest
+from ventos import replay
+
+def test_streams_must_be_positive(capsys):
+    for streams in ['0', '-2']:
+        with pytest.raises(SystemExit):
+            replay.main(['--streams', streams])
+        assert 'is not at least 1' in capsys.readouterr().err
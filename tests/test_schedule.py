@@ -0,0 +1,47 @@
+import os, copy
+from ventos import test_trace
+from ventos.test_trace import scenarios
+from ventos.sim import simple
+from ventos.sim.schedule import EventScheduler
+from conftest import quietly
+
+def run(s):
+    return quietly(simple.execute_scenario, s)
+
+def test_all_due_events_are_applied_together():
+    events = [dict(attr='Pi', val=20, time=2), dict(attr='rate', val=20, time=1), dict(attr='PEEP', val=8, time=1)]
+    scheduler = EventScheduler(events)
+    assert scheduler.pop_due(999) == []
+    assert scheduler.pop_due(1000) == [events[1], events[2]] # equal times keep the given order
+    segments = list(EventScheduler(events).segments(0, 5000, 50))
+    assert segments == [(0, 1050, [events[1], events[2]]), (1050, 2050, [events[0]]), (2050, 5000, [])]
+
+def test_scenario_events_are_left_untouched():
+    s = dict(scenarios()['Creeping'], end_time=60)
+    before = copy.deepcopy(s)
+    run(s)
+    assert s == before
+    shuffled = dict(s, events=list(reversed(s['events'])))
+    assert run(shuffled).equals(run(s))
+
+def test_high_resistance_changes_the_patient():
+    s = scenarios()['HighResistance']
+    assert any(e['attr'] == 'resistance' for e in s['events'])
+    p, v = simple.scenario_models(s)
+    quietly(simple.loop, p, v, end_time=s['end_time'] * 1000, time_resolution=s['time_resolution'], events=s['events'])
+    assert p.resistance == [e['val'] for e in s['events'] if e['attr'] == 'resistance'][-1]
+    assert not hasattr(v, 'resistance')
+
+# every simulator module is part of the hash that keys cached traces
+def test_code_version_covers_the_simulator(monkeypatch):
+    here = os.path.dirname(test_trace.__file__)
+    read = []
+    real_open = open
+    def recording_open(name, *args, **kwargs):
+        read.append(os.path.relpath(name, here))
+        return real_open(name, *args, **kwargs)
+    monkeypatch.setattr('builtins.open', recording_open)
+    test_trace.code_version()
+    for source in ['sim/simple.py', 'sim/schedule.py', 'sim/adaptive.py', 'sim/collapsible.py', 'sim/batch.py',
+                   'lung.py', 'model.py', 'columnar.py']:
+        assert source in read
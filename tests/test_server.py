@@ -0,0 +1,61 @@
+import asyncio, json, os.path, tempfile
+from ventos import server
+
+def measurement(ms, val):
+    return json.dumps(dict(event="M", type="P", loc="I", ms=ms, val=val)) + '\n'
+
+# send lines to a server on a temporary Unix socket, returning its counters
+# and any tasks still pending once the connection has been closed (or
+# failing after timeout seconds)
+def run(lines, timeout = 10, **options):
+    async def main():
+        ingest = server.IngestServer(**options)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ingest.sock')
+            listener = await ingest.start(path=path)
+            reader, writer = await asyncio.open_unix_connection(path)
+            try:
+                writer.writelines(line.encode() for line in lines)
+                await writer.drain()
+            except ConnectionError: # the server closed the connection
+                pass
+            writer.close()
+            async def closed():
+                while ingest.counters.connections < 1 or ingest.counters.open:
+                    await asyncio.sleep(0.01)
+            await asyncio.wait_for(closed(), timeout)
+            listener.close()
+            await listener.wait_closed()
+            await asyncio.sleep(0.01) # let cancelled tasks finish
+            pending = [t for t in asyncio.all_tasks() if t is not asyncio.current_task() and not t.done()]
+        return ingest.counters, pending
+    return asyncio.run(main())
+
+def test_malformed_lines_are_counted_and_skipped():
+    lines = ['{"event":"hello","device":"bed1"}\n', 'not json\n', '{"event":"M","type":"P","loc":"I"}\n',
+             '{"event":"M","type":"P","loc":"I","ms":"soon","val":5}\n', '[1, 2]\n']
+    lines += [measurement(ms, 5 + 10 * (ms // 2000 % 2)) for ms in range(0, 60000, 100)]
+    counters, pending = run(lines)
+    assert counters.bad == 4
+    assert counters.records == len(lines)
+    assert counters.errors == 0 and counters.open == 0
+    assert counters.events > 0 # breaths were still detected
+    assert not pending
+
+def test_processor_failure_closes_the_connection(monkeypatch, capsys):
+    def fail(self, records):
+        raise RuntimeError('detector failed')
+    monkeypatch.setattr(server.Device, 'feed_batch', fail)
+    # more lines than the queue holds, so the reader would block on a dead processor
+    counters, pending = run([measurement(ms, 5) for ms in range(0, 100000, 10)], queue_size=10, batch_size=5)
+    assert counters.errors == 1 and counters.open == 0 and not pending
+    assert 'detector failed' in capsys.readouterr().err
+
+# a line over the StreamReader limit fails the read, which closes the
+# connection and stops its processor
+def test_oversized_line_closes_the_connection(capsys):
+    lines = [measurement(ms, 5) for ms in range(0, 1000, 100)] + ['{"event":"M","pad":"' + 'x' * 100000 + '"}\n']
+    counters, pending = run(lines)
+    assert counters.errors == 1 and counters.open == 0
+    assert not pending
+    assert 'closing connection' in capsys.readouterr().err
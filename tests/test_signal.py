@@ -0,0 +1,53 @@
+from dataclasses import asdict
+import numpy as np, pandas as pd
+from ventos import signal
+from ventos.signal import VentilatorStatus, step
+
+def config(fs):
+    return signal.VentilatorConfig(sample_frequency=fs, alphaA=signal.retune_alpha(0.2, fs),
+                                   alphaN=signal.retune_alpha(0.1, fs), alphaR=signal.retune_alpha(0.9, fs))
+
+# the original sample by sample implementation of signal.process_trace, the
+# reference its array kernel is checked against
+def process_trace_stepwise(trace, config, pressure_column="pressure"):
+    next_time = -1 # ms
+    minimum_time_gap = 1000 / config.sample_frequency
+    vs = VentilatorStatus()
+    sp = [] # container for processed signals
+    for i, row in trace.iterrows():
+        p = row[pressure_column]
+        t = row.time
+        if t > next_time:
+            step(config, vs, p)
+            sp.append(dict(asdict(vs), time=t))
+            next_time += minimum_time_gap
+    results = pd.DataFrame.from_records(sp)
+    results['time_s'] = results['time'] / 1000
+    results['phase'] = results['inhaling'].astype(int) * 10 + 5
+    return results
+
+# values and dtypes are those of the stepwise loop, at several detector
+# rates and for integer only frames (where iterrows hands step() ints)
+def test_process_trace_matches_stepwise(traces):
+    for name, trace in traces.items():
+        for fs in (7, 10, 20):
+            assert signal.process_trace(trace, config(fs), 'PI').equals(
+                process_trace_stepwise(trace, config(fs), 'PI')), (name, fs)
+    trace = traces['Creeping'].astype(int)
+    assert signal.process_trace(trace, config(10), 'PE').equals(process_trace_stepwise(trace, config(10), 'PE'))
+
+# every field of every channel of the fleet is that of scalar step(), with
+# a config per channel, across blocks
+def test_fleet_matches_step(traces):
+    pressures = np.stack([trace['PI'].to_numpy()[:3000] for trace in traces.values()], axis=1)
+    configs = [signal.VentilatorConfig(alphaA=signal.retune_alpha(0.9, fs, 10), alphaR=signal.retune_alpha(0.99, fs, 10),
+                                       sample_frequency=fs) for fs in [10, 20, 7, 50] * 4][:pressures.shape[1]]
+    fleet = signal.VentilatorFleet(configs)
+    blocks = [fleet.step_block(pressures[:1000]), fleet.step_block(pressures[1000:])]
+    for j, c in enumerate(configs):
+        state = VentilatorStatus()
+        for i, p in enumerate(pressures[:, j].tolist()):
+            step(c, state, p)
+            block, k = (blocks[0], i) if i < 1000 else (blocks[1], i - 1000)
+            assert {field: block[field][k, j] for field in VentilatorStatus.__dataclass_fields__} == asdict(state), (j, i)
+        assert fleet.status(j) == state
@@ -0,0 +1,54 @@
+import io, json
+import numpy as np, pandas as pd
+from ventos import signal, stream
+from conftest import fixtures
+
+def records(filename):
+    with open(filename) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def breath_ends(results):
+    inhaling = results['inhaling'].to_numpy()
+    return np.flatnonzero(inhaling[:-1] & ~inhaling[1:]) + 1
+
+def test_feed_updates_state_without_iterating():
+    ts = stream.TraceStream()
+    for r in records(fixtures[0])[:400]:
+        ts.feed(r) # the returned events are ignored
+    assert ts.state.p != 0 and ts.next_time > -1 and ts.recent
+
+# breaths from the stream are those of process_trace on the same trace
+def test_stream_matches_process_trace(traces):
+    config = signal.VentilatorConfig(sample_frequency=10)
+    for filename in fixtures[:3]:
+        ts = stream.TraceStream(config)
+        events = [e for e in ts.process(records(filename), batch_size=37) if e['event'] == 'breath']
+        trace = traces[filename.split('/')[-1].split('_')[0]]
+        results = signal.process_trace(trace, config, 'PI')
+        ends = breath_ends(results)
+        assert [e['ms'] for e in events] == results['time'].iloc[ends].tolist()
+        assert [e['PIP'] for e in events] == results['PIP'].iloc[ends].tolist()
+
+def test_command_line(monkeypatch, capsys):
+    with open(fixtures[0]) as f:
+        monkeypatch.setattr('sys.stdin', io.StringIO(f.read()))
+    stream.main([])
+    events = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert events and all(e['event'] == 'breath' for e in events)
+
+# a resampling stream runs the detector on every period of resample_trace,
+# including the last one, which is only complete at the end of the records
+def test_resampling_stream_keeps_the_last_period(traces):
+    config = signal.VentilatorConfig(sample_frequency=10)
+    filename = fixtures[0]
+    ts = stream.TraceStream(config, status=True, resample=True)
+    statuses = [e for e in ts.process(records(filename), batch_size=37) if e['event'] == 'status']
+    results = signal.process_trace(traces[filename.split('/')[-1].split('_')[0]], config, 'PI', resample=True)
+    assert [e['ms'] for e in statuses] == results['time'].tolist()
+    assert ts.flush() == []
+
+def test_resample_empty_trace():
+    empty = pd.DataFrame(dict(time=np.empty(0, dtype=np.int64), PI=np.empty(0), PE=np.empty(0)))
+    resampled = signal.resample_trace(empty, 10)
+    assert list(resampled.columns) == ['time', 'PI', 'PE'] and len(resampled) == 0
+    assert signal.Resampler(10).flush()[1].shape == (0,)
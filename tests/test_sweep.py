@@ -0,0 +1,19 @@
+import io, contextlib
+from ventos import sweep
+from ventos.test_trace import base_scenario
+
+def test_results_are_kept_per_scenario_not_per_title(tmp_path):
+    base = dict(base_scenario, end_time=5, events=[])
+    scenarios = [dict(base, title='same', resistance=10), dict(base, title='same', resistance=40),
+                 dict(base, title='same', resistance=10)]
+    cache = sweep.Cache(str(tmp_path))
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        results = sweep.run(scenarios, cache=cache, workers=1)
+    assert out.getvalue().startswith('2 of 2 sweep points to simulate')
+    assert [s['resistance'] for s, df in results.values()] == [10, 40]
+    low, high = (df for s, df in results.values())
+    assert not low.equals(high)
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        again = sweep.run(scenarios, cache=cache, workers=1)
+    assert out.getvalue().startswith('0 of 2')
+    assert all(again[key][1].equals(df) for key, (s, df) in results.items())
@@ -0,0 +1,9 @@
+import sys
+import os.path
+
+# Run as a script (eg ventos/stream.py) the ventos directory is first on the
+# path, where ventos/signal.py would shadow the standard library signal module
+# that asyncio, subprocess and concurrent.futures import. The scripts import
+# ventos before the standard library, so it is taken off the path here.
+if sys.path and os.path.abspath(sys.path[0]) == os.path.dirname(os.path.abspath(__file__)):
+    sys.path.pop(0)
@@ -0,0 +1,129 @@
+import numpy as np, pandas as pd
+from ventos.signal import VentilatorConfig
+
+"""
+Offline breath analytics for recorded traces.
+
+signal.step() detects breaths one sample at a time, as a ventilator must.
+Offline the whole trace is at hand, so here it is segmented with array
+operations, in one pass:
+
+ * the pressure is smoothed by a centred moving average (cumsum) over the
+   time constant of the detector's alphaN smoothing,
+ * its envelope is the running maximum and minimum over envelope_seconds
+   (van Herk / Gil-Werman, so the cost does not grow with the window),
+ * inspiration starts where the pressure rises above 60% of the envelope
+   and expiration where it falls below 40% (hysteresis, so noise does not
+   split breaths), ignoring swings less than min_breath_envelope_delta,
+ * flow is integrated to volume by a cumulative sum, read at the breath
+   boundaries.
+
+breaths() returns a table with one row per complete breath:
+
+    start, expiration, end    ms
+    PIP, PEEP                 cmH2O, maximum and minimum of the smoothed pressure over the breath
+    RR                        breaths per minute
+    IE, Ti, Te                I:E ratio and its times (s)
+    tidal_volume_i, _e        ml inspired (flow_i) and expired (flow_e)
+
+for example
+
+    analytics.breaths(pdf) # from simple.execute_scenario
+    analytics.breaths(pirds.read(filename), pressure_column='PI', flow_columns=('FI', 'FE'))
+
+PIP and PEEP are each breath's own extremes. step() instead smooths them
+from breath to breath by alphaS, so on the test traces its PIP reads up to
+about 0.7 cmH2O lower and its PEEP as much higher.
+"""
+
+inspiration_threshold = 0.6 # fraction of the envelope
+expiration_threshold = 0.4
+
+# centred moving average over width samples (shrinking at the ends)
+def moving_average(x, width):
+    if width <= 1:
+        return x.astype(float)
+    total = np.concatenate(([0.0], np.cumsum(x, dtype=float)))
+    i = np.arange(len(x))
+    lo = np.maximum(i - width // 2, 0)
+    hi = np.minimum(i - width // 2 + width, len(x))
+    return (total[hi] - total[lo]) / (hi - lo)
+
+# maximum over the centred window of width samples, in O(n) for any width
+# from the running maxima forwards and backwards within blocks of width
+def rolling_max(x, width):
+    n = len(x)
+    if width <= 1 or n == 0:
+        return x.copy()
+    half = width // 2
+    padded = np.concatenate((np.full(half, -np.inf), x, np.full(width - half - 1 + (-(n + width - 1) % width), -np.inf)))
+    blocks = padded.reshape(-1, width)
+    forward = np.maximum.accumulate(blocks, axis=1).ravel()
+    backward = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    i = np.arange(n) # window i .. i + width - 1 of padded
+    return np.maximum(backward[i], forward[i + width - 1])
+
+def rolling_min(x, width):
+    return -rolling_max(-x, width)
+
+# samples of a moving average spanning the time constant of recursive_smooth(alpha)
+# (1 / (1 - alpha) samples) at sample_frequency, rescaled to samples at trace_frequency
+def smoothing_width(alpha, sample_frequency, trace_frequency):
+    width = 1 / (1 - alpha) if alpha < 1 else 1
+    return max(1, round(width * trace_frequency / sample_frequency))
+
+# indices of inspiration and expiration starts in pressure (an array)
+# returns (inspirations, expirations), the expiration after each inspiration
+# (or len(pressure) for a trace ending during inspiration)
+def segment(pressure, envelope_width, delta):
+    high = rolling_max(pressure, envelope_width)
+    low = rolling_min(pressure, envelope_width)
+    swing = high - low
+    valid = swing > delta
+    above = valid & (pressure >= low + inspiration_threshold * swing)
+    below = valid & (pressure <= low + expiration_threshold * swing)
+    # phase holds between crossings: the last sample that was above or below
+    n = len(pressure)
+    i = np.arange(n)
+    last_above = np.maximum.accumulate(np.where(above, i, -1))
+    last_below = np.maximum.accumulate(np.where(below, i, -1))
+    inhaling = last_above > last_below
+    changes = np.flatnonzero(np.diff(inhaling.astype(np.int8))) + 1
+    inspirations = changes[inhaling[changes]]
+    expirations = changes[~inhaling[changes]]
+    # pair each inspiration with the next expiration
+    following = np.searchsorted(expirations, inspirations)
+    expirations = np.append(expirations, n)[following]
+    return inspirations, expirations
+
+# per breath table of a trace (dataframe with time in ms), see above
+# flow_columns (l/s) are integrated to tidal volumes, give None to skip
+def breaths(trace, config = None, pressure_column = 'pressure_1', flow_columns = ('flow_i', 'flow_e'),
+            envelope_seconds = 10):
+    config = config or VentilatorConfig()
+    time = trace['time'].to_numpy(dtype=float)
+    raw = trace[pressure_column].to_numpy(dtype=float)
+    trace_frequency = 1000 / np.median(np.diff(time)) if len(time) > 1 else config.sample_frequency
+    pressure = moving_average(raw, smoothing_width(config.alphaN, config.sample_frequency, trace_frequency))
+    envelope_width = max(2, round(envelope_seconds * trace_frequency))
+    inspirations, expirations = segment(pressure, envelope_width, config.min_breath_envelope_delta)
+    # a breath runs from one inspiration to the next
+    start, end = inspirations[:-1], inspirations[1:]
+    expiration = expirations[:-1]
+    if len(start):
+        PIP = np.maximum.reduceat(pressure, inspirations)[:-1]
+        # the minimum of each breath's expiration
+        bounds = np.ravel(np.column_stack((expiration, end)))
+        PEEP = np.minimum.reduceat(pressure, bounds)[::2]
+    else:
+        PIP = PEEP = np.empty(0)
+    Ti = (time[expiration] - time[start]) / 1000
+    Te = (time[end] - time[expiration]) / 1000
+    table = dict(start=time[start], expiration=time[expiration], end=time[end], PIP=PIP, PEEP=PEEP,
+                 RR=60 / (Ti + Te), IE=Ti / Te, Ti=Ti, Te=Te)
+    if flow_columns:
+        dt = np.diff(time, append=time[-1] if len(time) else 0) / 1000 # seconds each sample lasts
+        for name, column, sign in zip(['tidal_volume_i', 'tidal_volume_e'], flow_columns, [1, -1]):
+            volume = np.concatenate(([0.0], np.cumsum(trace[column].to_numpy(dtype=float) * dt))) * 1000 # ml
+            table[name] = sign * (volume[end] - volume[start])
+    return pd.DataFrame(table)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3.7
+import sys
+import os.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import ventos # first, see ventos/__init__.py
+import json, time, argparse, tracemalloc, contextlib, io, subprocess
+import numpy as np
+from ventos import lung, signal
+from ventos.sim import simple
+
+"""
+Benchmarks for the generate -> encode -> detect pipeline.
+
+Each stage is timed on a trace of base_scenario at each sample frequency and
+duration, and reported as throughput (samples/second) and peak memory
+(allocations traced with tracemalloc, in a separate run so tracing does not
+slow the timed one). Noise is seeded so every run sees the same data, and
+each stage is timed --repeat times keeping the fastest, to reduce noise.
+
+    ventos/benchmark.py --save baseline.json
+    ventos/benchmark.py --compare baseline.json
+
+Combinations above --max-samples are skipped (24 h at 1 kHz is 86 million
+samples), raise it to run them.
+
+--imports instead checks the start up cost of each entry point against
+import_budgets: the time to import it in a fresh interpreter (on top of
+numpy, which everything needs) and that it loads none of heavy_modules.
+"""
+
+# parse durations like 30, 30s, 5m, 1h or 24h into seconds
+def seconds(duration):
+    units = dict(s=1, m=60, h=3600)
+    if duration[-1] in units:
+        return int(float(duration[:-1]) * units[duration[-1]])
+    return int(duration)
+
+def scenario(frequency, duration):
+    from ventos.test_trace import base_scenario
+    return dict(base_scenario, time_resolution = round(1000 / frequency), end_time = duration, events = [])
+
+# run each stage once on the given trace size, calling measure(stage, samples, run)
+# where run() performs the stage. Stages feed each other, as in update_files
+def pipeline(frequency, duration, seed, measure):
+    s = scenario(frequency, duration)
+    np.random.seed(seed)
+    volumes = np.random.uniform(30, 90, len(range(0, duration * 1000, s['time_resolution'])) + 1) # % TLC
+    n = len(volumes)
+    measure('lung.scalar', n, lambda: [lung.pressure_from_volume(v) for v in volumes.tolist()])
+    measure('lung.vectorized', n, lambda: lung.pressure_from_volume_vectorized(volumes))
+    def run_loop():
+        p = simple.Patient(resistance=s['resistance'], pressure_mouth=s['PEEP'])
+        v = simple.Ventilator(PEEP=s['PEEP'], rate=s['rate'], IE=s['IE'], Pi=s['Pi'])
+        return simple.loop(p, v, end_time=s['end_time'] * 1000, time_resolution=s['time_resolution'])
+    pdf = measure('loop', n, run_loop)
+    # decorate_sim adds noise in place, so each run decorates a fresh copy and
+    # the later stages see the same decorated frame however many runs there are
+    def run_decorate():
+        decorated = pdf.copy()
+        simple.decorate_sim(decorated, dict(s, seed = seed))
+        return decorated
+    pdf = measure('decorate_sim', n, run_decorate)
+    measure('df_to_PIRDS', n, lambda: simple.df_to_PIRDS(pdf))
+    config = signal.VentilatorConfig(sample_frequency=frequency)
+    measure('process_trace', n, lambda: signal.process_trace(pdf, config, pressure_column='pressure_1'))
+
+# time (and optionally trace the memory of) every stage for one trace size
+def benchmark(frequency, duration, seed = 0, memory = True, repeat = 3):
+    results = {}
+    def timed(stage, samples, run):
+        elapsed = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = run()
+            elapsed = min(elapsed, time.perf_counter() - start)
+        results[stage] = dict(stage=stage, frequency=frequency, duration=duration, samples=samples,
+                              seconds=elapsed, samples_per_second=samples / elapsed if elapsed else float('inf'))
+        return result
+    def traced(stage, samples, run):
+        tracemalloc.start()
+        try:
+            result = run()
+            results[stage]['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return result
+    with contextlib.redirect_stdout(io.StringIO()): # the simulator reports events
+        pipeline(frequency, duration, seed, timed)
+        if memory:
+            pipeline(frequency, duration, seed, traced)
+    return list(results.values())
+
+def key(r):
+    return f"{r['stage']}@{r['frequency']}Hz/{r['duration']}s"
+
+def report(results, baseline = None, threshold = 0.1):
+    baseline = {key(r): r for r in baseline or []}
+    print(f"{'stage':16} {'Hz':>5} {'duration':>8} {'samples':>10} {'seconds':>9} {'samples/s':>12} {'peak MB':>8}"
+          + (f" {'vs base':>8}" if baseline else ''))
+    regressions = []
+    for r in results:
+        line = (f"{r['stage']:16} {r['frequency']:>5} {r['duration']:>7}s {r['samples']:>10} {r['seconds']:>9.3f} "
+                f"{r['samples_per_second']:>12.0f} "
+                + (f"{r['peak_bytes'] / 1e6:>8.1f}" if 'peak_bytes' in r else f"{'-':>8}"))
+        if key(r) in baseline:
+            ratio = r['samples_per_second'] / baseline[key(r)]['samples_per_second']
+            line += f" {ratio:>7.2f}x"
+            if ratio < 1 - threshold:
+                line += ' SLOWER'
+                regressions.append(key(r))
+        print(line)
+    return regressions
+
+# modules only the paths that need them may import
+heavy_modules = ['pandas', 'matplotlib', 'scipy', 'pynverse']
+
+# ms to import each entry point, beyond numpy
+import_budgets = {
+    'ventos.lung': 10,
+    'ventos.model': 10,
+    'ventos.instrument': 10,
+    'ventos.columnar': 10,
+    'ventos.sim.noise': 10,
+    'ventos.signal': 40,
+    'ventos.sim.simple': 40,
+    'ventos.pirds': 40,
+    'ventos.stream': 40,
+    'ventos.render': 30,
+    'ventos.test_trace': 80,
+    'ventos.replay': 100, # asyncio
+    'ventos.server': 150}
+
+# (seconds, heavy modules loaded) importing module in a fresh interpreter,
+# the fastest of repeat runs
+def import_time(module, repeat = 3):
+    code = (f"import sys, time, json, numpy; start = time.perf_counter(); import {module}; "
+            f"print(json.dumps([time.perf_counter() - start, [m for m in {heavy_modules!r} if m in sys.modules]]))")
+    root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True)
+        runs.append(json.loads(output.stdout.strip().split('\n')[-1]))
+    return min(runs)
+
+# report import times against their budgets, returning the entry points over budget
+def check_imports(budgets = import_budgets, repeat = 3):
+    print(f"{'module':20} {'ms':>7} {'budget':>7}  heavy modules")
+    failures = []
+    for module, budget in budgets.items():
+        seconds, loaded = import_time(module, repeat)
+        ms = seconds * 1000
+        line = f"{module:20} {ms:>7.1f} {budget:>7}  {', '.join(loaded) or '-'}"
+        if ms > budget or loaded:
+            line += ' OVER'
+            failures.append(module)
+        print(line)
+    return failures
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='benchmark the trace generation, encoding and detection pipeline')
+    parser.add_argument('--frequencies', default='10,20,100,1000', help='sample frequencies (Hz)')
+    parser.add_argument('--durations', default='30s,5m,1h,24h', help='trace durations (s, m or h)')
+    parser.add_argument('--max-samples', type=int, default=1000000, help='skip larger traces')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage (the fastest is kept)')
+    parser.add_argument('--no-memory', action='store_true', help='skip the (slower) peak memory run')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare with results saved by --save')
+    parser.add_argument('--threshold', type=float, default=0.1, help='throughput drop reported as a regression')
+    parser.add_argument('--imports', action='store_true', help='check import times against their budgets instead')
+    args = parser.parse_args(argv)
+    if args.imports:
+        failures = check_imports(repeat = args.repeat)
+        if failures:
+            print(f'{len(failures)} over budget: {", ".join(failures)}')
+            return 1
+        return 0
+    results = []
+    for frequency in [int(f) for f in args.frequencies.split(',')]:
+        for duration in [seconds(d) for d in args.durations.split(',')]:
+            if frequency * duration > args.max_samples:
+                print(f'skipping {frequency}Hz for {duration}s ({frequency * duration} samples > --max-samples)')
+                continue
+            results += benchmark(frequency, duration, args.seed, memory = not args.no_memory, repeat = args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    regressions = report(results, baseline, args.threshold)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1)
+    if regressions:
+        print(f'{len(regressions)} regressions: {", ".join(regressions)}')
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+import numpy as np
+
+"""
+Compact binary columnar trace files.
+
+A trace is stored as a single .npy file holding a (5, n) int32 array, one
+row per column, in the order of trace_columns. The values are the PIRDS
+integers (ms, cmH2O, ml/min) so the file is lossless with respect to the
+.pirds.json written for the same simulation, at 20 bytes per sample. A trace
+with values int32 cannot hold (times past 2**31 ms, about 24.8 days) is
+stored as int64 instead, at 40 bytes per sample.
+
+Because each column is contiguous on disk the file can be memory-mapped and
+each column returned as a zero-copy view, and a time window can be found by
+binary search on the time column without reading the rest of the file.
+"""
+
+trace_columns = ['time', 'PI', 'PE', 'FI', 'FE']
+trace_dtype = np.int32
+wide_dtype = np.int64 # for traces whose values do not fit trace_dtype
+
+# pandas (via ventos.sim.simple) is only imported by write and load_frame, so
+# reading columns needs nothing beyond numpy
+
+# write the simulation dataframe df (as returned by execute_scenario)
+def write(df, filename):
+    from ventos.sim.simple import PIRDS_arrays
+    ms, val = PIRDS_arrays(df)
+    limits = np.iinfo(trace_dtype)
+    fits = all(limits.min <= a.min() and a.max() <= limits.max for a in (ms, val) if a.size)
+    data = np.lib.format.open_memmap(filename, mode='w+', dtype=trace_dtype if fits else wide_dtype,
+                                     shape=(len(trace_columns), len(df)))
+    data[0] = ms
+    data[1:] = val.T
+    data.flush()
+    del data
+
+# memory map a trace file, returning the (5, n) array
+def load(filename):
+    return np.load(filename, mmap_mode='r')
+
+# dict of column views, optionally limited to start_ms <= time < end_ms
+def load_columns(filename, start_ms = None, end_ms = None):
+    data = load(filename)
+    time = data[0]
+    first = 0 if start_ms is None else np.searchsorted(time, start_ms, side='left')
+    last = len(time) if end_ms is None else np.searchsorted(time, end_ms, side='left')
+    return {name: data[i, first:last] for i, name in enumerate(trace_columns)}
+
+# as load_columns, but as a pandas DataFrame (which copies the window)
+def load_frame(filename, start_ms = None, end_ms = None):
+    import pandas as pd
+    return pd.DataFrame(load_columns(filename, start_ms, end_ms))
@@ -0,0 +1,130 @@
+import time, json, tracemalloc
+
+"""
+Opt-in per stage instrumentation.
+
+Functions on the trace hot paths (simple.execute_scenario, simple.loop,
+signal.process_trace and test_trace.update_files) take an optional stats
+argument. Pass a Stats to record, per named stage, the wall time, number of
+calls and the net bytes allocated (when tracing memory):
+
+    stats = instrument.Stats(memory=True)
+    pdf = simple.execute_scenario(s, stats=stats)
+    print(stats.report())
+    stats.dump('stats.json')
+
+When stats is None the functions use null, whose stage() is a shared do
+nothing context manager and whose timed() hands back the function
+unchanged, so the disabled cost is a few attribute lookups per stage and
+nothing per simulation step.
+
+Stages may nest, so times are inclusive. Allocated bytes need tracemalloc,
+which Stats(memory=True) starts if nothing else has (and which slows
+everything down a lot, so compare times from runs without it) and
+close() stops again.
+"""
+
+class Stage:
+    __slots__ = ['stats', 'name', 'start', 'memory']
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.memory = tracemalloc.get_traced_memory()[0] if self.stats.memory else 0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        allocated = tracemalloc.get_traced_memory()[0] - self.memory if self.stats.memory else 0
+        self.stats.add(self.name, elapsed, 1, allocated)
+        return False
+
+class Stats:
+    # trace False reports bytes without tracing in this process, for totals
+    # merged from Stats that trace their own (eg in worker processes)
+    def __init__(self, memory = False, trace = True):
+        self.memory = memory
+        self.tracing = memory and trace and not tracemalloc.is_tracing() # so close() only stops our own tracing
+        if self.tracing:
+            tracemalloc.start()
+        self.stages = {} # name: dict(calls, seconds, bytes)
+
+    def __bool__(self):
+        return True
+
+    # stop tracing memory, if this started it
+    def close(self):
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+    # context manager recording one call of the named stage
+    def stage(self, name):
+        return Stage(self, name)
+
+    # function wrapped to record each call as the named stage
+    def timed(self, name, function):
+        def wrapper(*args, **kwargs):
+            with Stage(self, name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    def add(self, name, seconds, calls = 1, allocated = 0):
+        stage = self.stages.setdefault(name, dict(calls=0, seconds=0.0, bytes=0))
+        stage['calls'] += calls
+        stage['seconds'] += seconds
+        stage['bytes'] += allocated
+
+    # add the stages of another Stats (or its as_dict(), eg from a worker process)
+    def merge(self, other):
+        for name, stage in (other.as_dict() if isinstance(other, Stats) else other).items():
+            self.add(name, stage['seconds'], stage['calls'], stage['bytes'])
+        return self
+
+    def as_dict(self):
+        return {name: dict(stage) for name, stage in self.stages.items()}
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), indent=1)
+
+    def dump(self, filename):
+        with open(filename, 'w') as f:
+            f.write(self.to_json())
+
+    def report(self):
+        lines = [f"{'stage':32} {'calls':>9} {'seconds':>10} {'ms/call':>9} {'MB':>8}"]
+        for name, s in self.stages.items():
+            lines.append(f"{name:32} {s['calls']:>9} {s['seconds']:>10.3f} {1000 * s['seconds'] / s['calls']:>9.3f} "
+                         + (f"{s['bytes'] / 1e6:>8.1f}" if self.memory else f"{'-':>8}"))
+        return '\n'.join(lines)
+
+class NullStage:
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+class NullStats:
+    memory = False
+    stage_context = NullStage()
+
+    def __bool__(self):
+        return False
+
+    def stage(self, name):
+        return self.stage_context
+
+    def timed(self, name, function):
+        return function
+
+    def add(self, name, seconds, calls = 1, allocated = 0):
+        pass
+
+# stand in used when instrumentation is disabled
+null = NullStats()
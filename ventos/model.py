@@ -1,4 +1,4 @@
-import math
+import math, numpy as np
 
 """
 Symbol	Description	Unit
@@ -77,14 +77,43 @@ def VC(Ptm):
 def RC(VC):
     return Kc * (VCmax/VC)**2
 
+# array forms of the model, written with numpy ufuncs and np.where rather than
+# python branches so many patients or time points are evaluated in one call
+# (RC above already works on arrays)
+
+# Eq 15 on arrays. Both branches are evaluated, with their arguments clamped
+# so neither produces nan/overflow on the side that is not selected
+def VC_vectorized(Ptm):
+    Ptm = np.asarray(Ptm, dtype=float)
+    low = np.maximum(VCmin, VCmax * (Dc - np.sqrt(np.maximum(Ac - Ptm, 0) / Bc)))
+    high = np.minimum(VCmax / (D1c + np.exp(np.minimum((A1c - Ptm) / B1c, 700))), VCmax)
+    return np.where(Ptm < Ptmmid, low, high)
+
+# static lung elastic recoil for alveolar volume VA (l)
+def Pl(VA):
+    return Al * np.exp(Kl * VA) + Bl
+
+# chest wall pressure for chest wall volume Vcw (l), clamped inside (VR, TLC]
+def Pcw(Vcw):
+    Vcw = np.maximum(Vcw, VR + 1e-9)
+    return Acw - Bcw * np.log(np.maximum((TLC - VR) / (Vcw - VR) - Dcw, 1e-12))
+
+# upper airway resistance (Rohrer) for flow F (l/s)
+def RU(F):
+    return Au + Ku * np.abs(F)
+
+# small airway resistance, falling exponentially as the alveoli inflate
+# (Ks is tabulated as a magnitude, the exponent is negative)
+def RS(VA):
+    return As * np.exp(-Ks * (VA - VR) / (Vstar - VR)) + Bs
+
 def test():
     print (f'Ptmmid {Ptmmid}')
     for p in range(-15, 40, 5):
         print (f'Ptmmid {p} -> VC {VC(p):.2f}, RC = {RC(VC(p)):.2f}')
 
-
-
-test()
+if __name__ == "__main__":
+    test()
 
 
 
@@ -0,0 +1,156 @@
+import re, os, json
+import numpy as np
+from ventos.sim.simple import PIRDS_channels
+
+"""
+Fast reader for PIRDS JSON-lines files (as written by simple.write_PIRDS).
+
+Rather than pd.read_json(lines=True) followed by a pivot, the file is read as
+bytes and the records parsed in bulk with a regular expression (lines in
+another layout fall back to json.loads), straight into a wide dataframe with
+one row per ms and one column per measurement: time, PI, PE, FI, FE (type
+and location, in the order of columnar.trace_columns; other measurements
+get columns after these). With scale=True the values are converted back to
+the simulator's units (cmH2O, l/s) by the scales in simple.PIRDS_channels.
+
+    df = pirds.read('test_traces/Wimpy_20x240.pirds.json')
+    signal.process_trace(df, config, pressure_column='PI')
+
+A time window is read by scanning the file:
+
+    df = pirds.read(filename, start_ms=60000, end_ms=120000)
+
+or, with index=True, by seeking to it through an index of the ms and byte
+offset of every stride-th line. The index is built on first use and saved
+next to the file (.index.npz, rebuilt when the file changes), so pass it only
+where writing there is wanted, eg for repeated windows into a large file.
+
+read_chunks() streams a file as wide dataframes of about chunk_bytes of
+input each, never splitting the records of one ms between chunks.
+"""
+
+record = re.compile(rb'\{"event":"M","type":"([^"]*)","loc":"([^"]*)","ms":(-?\d+),"val":(-?\d+)\}')
+columns = [t + l for t, l, _, _ in PIRDS_channels] # PI, PE, FI, FE
+scales = {t + l: scale for t, l, _, scale in PIRDS_channels}
+index_stride = 1024
+
+# parse PIRDS JSON-lines (bytes) into long format arrays: names (type + loc)
+# and integer ms and val. Only measurement ("M") records are returned
+def parse(data):
+    matches = record.findall(data)
+    lines = data.count(b'\n') + (not data.endswith(b'\n') and len(data) > 0)
+    if len(matches) < lines and data.strip():
+        matches = [] # another layout (or other events): parse line by line
+        for line in data.splitlines():
+            if line.strip():
+                r = json.loads(line)
+                if r.get("event") == "M":
+                    matches.append((r["type"].encode(), r["loc"].encode(), r["ms"], r["val"]))
+    if not matches:
+        return np.array([], dtype='S2'), np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    types, locs, ms, val = zip(*matches)
+    names = np.char.add(np.array(types), np.array(locs))
+    return names, np.array(ms).astype(np.int64), np.array(val).astype(np.int64)
+
+# wide dataframe from long format arrays, one row per ms
+# values are int where every ms has every measurement (and scale is False),
+# otherwise float with NaN for missing measurements
+def pivot(names, ms, val, scale = True):
+    unique, channel = np.unique(names, return_inverse=True)
+    found = [n.decode() for n in unique]
+    order = [c for c in columns if c in found] + [c for c in found if c not in columns]
+    time, row = np.unique(ms, return_inverse=True)
+    wide = {'time': time}
+    for name in order:
+        mask = channel == found.index(name)
+        if mask.sum() == len(time) and not scale:
+            column = np.empty(len(time), dtype=np.int64)
+        else:
+            column = np.full(len(time), np.nan)
+        column[row[mask]] = val[mask]
+        if scale and name in scales:
+            column = column / scales[name]
+        wide[name] = column
+    import pandas as pd
+    return pd.DataFrame(wide)
+
+# (ms, byte offset) of every stride-th line of a file, sorted by offset
+def build_index(filename, stride = index_stride):
+    with open(filename, 'rb') as f:
+        data = f.read()
+    starts = np.concatenate(([0], np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord('\n')) + 1))
+    starts = starts[starts < len(data)][::stride]
+    ms = []
+    for start in starts.tolist():
+        end = data.find(b'\n', start)
+        match = re.search(rb'"ms":\s*(-?\d+)', data[start:end if end >= 0 else len(data)])
+        ms.append(int(match.group(1)) if match else -1)
+    return np.array(ms, dtype=np.int64), starts.astype(np.int64)
+
+def index_filename(filename):
+    return f'{filename}.index.npz'
+
+# the saved index of a file, (re)building it if missing or out of date
+def load_index(filename, stride = index_stride):
+    stat = os.stat(filename)
+    try:
+        with np.load(index_filename(filename)) as saved:
+            if saved['size'] == stat.st_size and saved['mtime'] == stat.st_mtime_ns and saved['stride'] == stride:
+                return saved['ms'], saved['offset']
+    except (FileNotFoundError, OSError, KeyError):
+        pass
+    ms, offset = build_index(filename, stride)
+    try:
+        np.savez(index_filename(filename), ms=ms, offset=offset, size=stat.st_size, mtime=stat.st_mtime_ns,
+                 stride=stride)
+    except OSError: # eg a read only directory, the index is just not kept
+        pass
+    return ms, offset
+
+# byte range of a file holding every record with start_ms <= ms < end_ms
+# (for files in time order)
+def window_range(ms, offset, start_ms = None, end_ms = None):
+    first = 0 if start_ms is None else max(np.searchsorted(ms, start_ms, side='left') - 1, 0)
+    last = len(ms) if end_ms is None else np.searchsorted(ms, end_ms, side='left')
+    return offset[first], offset[last] if last < len(offset) else None
+
+# read a PIRDS file (or the window start_ms <= ms < end_ms of one) as a wide dataframe
+# with index=True a window is read by seeking through the saved index (see load_index)
+def read(filename, start_ms = None, end_ms = None, scale = True, index = False):
+    with open(filename, 'rb') as f:
+        if start_ms is None and end_ms is None or not index:
+            data = f.read()
+        else:
+            begin, end = window_range(*load_index(filename), start_ms, end_ms)
+            f.seek(begin)
+            data = f.read() if end is None else f.read(end - begin)
+    names, ms, val = parse(data)
+    keep = np.ones(len(ms), dtype=bool)
+    if start_ms is not None:
+        keep &= ms >= start_ms
+    if end_ms is not None:
+        keep &= ms < end_ms
+    return pivot(names[keep], ms[keep], val[keep], scale)
+
+# stream a PIRDS file as wide dataframes from about chunk_bytes of input each
+# records of the last ms in a chunk are held back for the next, so no row is
+# split between chunks (for files in time order)
+def read_chunks(filename, chunk_bytes = 1 << 24, scale = True):
+    held = (np.array([], dtype='S2'), np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+    remainder = b''
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(chunk_bytes)
+            data = remainder + block
+            if block:
+                cut = data.rfind(b'\n') + 1 # only parse whole lines
+                data, remainder = data[:cut], data[cut:]
+            names, ms, val = (np.concatenate(pair) for pair in zip(held, parse(data)))
+            if block and len(ms):
+                complete = ms < ms[-1]
+                held = (names[~complete], ms[~complete], val[~complete])
+                names, ms, val = names[complete], ms[complete], val[complete]
+            if len(ms):
+                yield pivot(names, ms, val, scale)
+            if not block:
+                return
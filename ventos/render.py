@@ -0,0 +1,201 @@
+#!/usr/bin/env python3.7
+import sys
+import os.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import ventos # first, see ventos/__init__.py
+import glob, argparse, time
+import numpy as np
+
+"""
+Fast plots of long traces.
+
+A plot can show no more detail than its axes have pixels, so each series is
+decimated before it is handed to matplotlib: min_max keeps the first, last,
+lowest and highest sample in each pixel column (so peaks and dropouts are
+never lost), lttb (largest triangle three buckets) keeps the visually most
+significant sample per bucket. Either way an hour at 1 kHz draws as a few
+thousand points.
+
+A Renderer draws onto a single figure that it reuses, setting the data of its
+lines rather than creating new axes, on the non-interactive Agg canvas (so no
+pyplot figures accumulate), and drops the data after each save:
+
+    renderer = Renderer()
+    renderer.save(pdf, 'Creeping', 'Creeping.png')
+
+Whole directories of trace files (.pirds.json or .trace.npy, plotted from
+the PIRDS channels) are rendered from the command line, skipping plots newer
+than their trace:
+
+    ventos/render.py test_traces --method lttb
+"""
+
+# axes of a plot: label and (column, colour) series
+simulation_axes = [
+    ('Flow (l/s)', [('flow', 'dimgray'), ('flow_i', 'tab:orange'), ('flow_e', 'tab:blue')]),
+    ('P (cmH2O)', [('pressure_mouth', 'dimgray'), ('pressure_1', 'tab:green'), ('pressure_2', 'tab:green')]),
+    ('Volume (ml)', [('lung_volume', 'tab:orange')])]
+PIRDS_axes = [
+    ('Flow (l/s)', [('FI', 'tab:orange'), ('FE', 'tab:blue')]),
+    ('P (cmH2O)', [('PI', 'tab:green'), ('PE', 'tab:olive')])]
+
+# indexes of the first, last, lowest and highest y in each of pixels buckets
+def min_max_index(y, pixels):
+    n = len(y)
+    width = -(-n // pixels)
+    buckets = -(-n // width)
+    # pad with the last value, which is already in the last bucket
+    blocks = np.pad(y, (0, buckets * width - n), mode='edge').reshape(buckets, width)
+    first = np.arange(buckets) * width
+    index = np.concatenate([first, first + np.argmin(blocks, axis=1), first + np.argmax(blocks, axis=1),
+                            first + width - 1])
+    return np.unique(np.minimum(index, n - 1))
+
+def min_max(x, y, pixels):
+    if len(y) <= 4 * pixels:
+        return x, y
+    index = min_max_index(y, pixels)
+    return x[index], y[index]
+
+# largest triangle three buckets downsampling to threshold points
+def lttb(x, y, threshold):
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return x, y
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int) # threshold - 2 buckets between the ends
+    index = np.empty(threshold, dtype=int)
+    index[0], index[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        lo, hi = edges[i], edges[i + 1]
+        after = slice(edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else slice(n - 1, n)
+        cx, cy = x[after].mean(), y[after].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + np.argmax(area)
+        index[i + 1] = a
+    return x[index], y[index]
+
+# decimate a series for a plot pixels wide, by 'min_max', 'lttb' or None (keep every sample)
+def decimate(x, y, pixels, method = 'min_max'):
+    if method == 'min_max':
+        return min_max(x, y, pixels)
+    if method == 'lttb':
+        return lttb(x, y, 2 * pixels)
+    return x, y
+
+class Renderer:
+    # figure defaults to a new one on the Agg canvas, or draw on a pyplot figure to show it
+    def __init__(self, axes = simulation_axes, figure = None, method = 'min_max', size = (6.4, 4.8), dpi = 100):
+        if figure is None:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            figure = Figure(figsize=size, dpi=dpi)
+            FigureCanvasAgg(figure)
+        self.figure = figure
+        self.axes = axes
+        self.method = method
+        self.plots = figure.subplots(len(axes), sharex=True, squeeze=False)[:, 0]
+        for ax in self.plots:
+            ax.spines['top'].set_visible(False)
+            ax.spines['bottom'].set_visible(False)
+            ax.spines['right'].set_visible(False)
+        self.plots[-1].spines['bottom'].set_visible(True)
+        self.lines = []
+        for ax, (label, series) in zip(self.plots, axes):
+            self.lines.append([ax.plot([], [], colour)[0] for column, colour in series])
+            ax.set(ylabel = label)
+            ax.label_outer()
+        self.plots[-1].set(xlabel = 'time (seconds)')
+        self.title = figure.suptitle('')
+
+    # width of the axes in pixels
+    def pixels(self):
+        return max(1, int(self.plots[0].get_window_extent().width))
+
+    def draw(self, df, title):
+        seconds = df['time'].to_numpy() / 1000
+        pixels = self.pixels()
+        for ax, (label, series), lines in zip(self.plots, self.axes, self.lines):
+            for (column, colour), line in zip(series, lines):
+                line.set_data(*decimate(seconds, df[column].to_numpy(dtype=float), pixels, self.method))
+            ax.relim()
+            ax.autoscale_view()
+        self.title.set_text(title)
+
+    # forget the plotted data, keeping the figure for the next trace
+    def clear(self):
+        for lines in self.lines:
+            for line in lines:
+                line.set_data([], [])
+
+    def save(self, df, title, filename):
+        self.draw(df, title)
+        self.figure.savefig(filename)
+        self.clear()
+
+# one renderer per layout, reused by every save in this process
+renderers = {}
+
+def save(df, title, filename, axes = simulation_axes, method = 'min_max'):
+    key = (id(axes), method)
+    if key not in renderers:
+        renderers[key] = Renderer(axes, method=method)
+    renderers[key].save(df, title, filename)
+
+# dataframe of time and the PIRDS channels (cmH2O, l/s) from a .pirds.json or .trace.npy file
+def load_trace(filename):
+    from ventos import pirds, columnar
+    if filename.endswith('.trace.npy'):
+        df = columnar.load_frame(filename)
+        for column, scale in pirds.scales.items():
+            df[column] = df[column] / scale
+        return df
+    return pirds.read(filename)
+
+trace_suffixes = ('.trace.npy', '.pirds.json')
+
+# name of a trace file without its trace suffix, so X.pirds.json and
+# X.trace.npy share the stem X
+def trace_stem(filename, suffixes = trace_suffixes):
+    for suffix in suffixes:
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return os.path.splitext(filename)[0]
+
+def plot_filename(filename):
+    return trace_stem(filename) + '.png'
+
+# render one plot of each trace in path (X.png for X.trace.npy and/or
+# X.pirds.json, read from the first of suffixes present) if newer than its
+# plot, returning the plots written
+def render_directory(path, suffixes = trace_suffixes, method = 'min_max', force = False):
+    traces = {}
+    for suffix in suffixes:
+        for filename in glob.glob(os.path.join(path, '*' + suffix)):
+            traces.setdefault(trace_stem(filename, suffixes), []).append(filename)
+    written = []
+    for stem, filenames in sorted(traces.items()):
+        target = stem + '.png'
+        newest = max(map(os.path.getmtime, filenames))
+        if not force and os.path.exists(target) and os.path.getmtime(target) >= newest:
+            continue
+        title = os.path.basename(stem).split('.')[0]
+        save(load_trace(filenames[0]), title, target, PIRDS_axes, method)
+        written.append(target)
+    return written
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='plot every trace file in a directory')
+    parser.add_argument('path', nargs='?', default='test_traces')
+    parser.add_argument('--method', choices=['min_max', 'lttb', 'none'], default='min_max',
+                        help='decimation of each series to the plot width')
+    parser.add_argument('--force', action='store_true', help='replot traces whose plots are up to date')
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    written = render_directory(args.path, method=None if args.method == 'none' else args.method, force=args.force)
+    for filename in written:
+        print(filename)
+    print(f'{len(written)} plots in {time.perf_counter() - start:.2f}s', file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
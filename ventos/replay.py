@@ -0,0 +1,197 @@
+#!/usr/bin/env python3.7
+import sys
+import os.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import ventos # first, see ventos/__init__.py
+import asyncio, json, time, argparse, io, contextlib, itertools, bisect
+import numpy as np
+
+"""
+Real time replay of simulated traces as PIRDS JSON-lines, for load testing.
+
+Each of N streams plays a scenario from test_trace.scenarios() (cycling
+through the badnesses) to its own sink, pacing records by their ms times at
+--speed times real time (0 for as fast as possible):
+
+    ventos/replay.py --streams 100 --speed 10 --sink tcp:localhost:5555
+    ventos/replay.py --streams 4 --sink 'out/bed{i}.pirds.json'
+    ventos/replay.py --speed 1 --sink -
+
+Sinks are - (stdout), tcp:host:port, unix:path or a file name ({i} is
+replaced by the stream number). --jitter delays each write by up to that many
+ms, --drop loses each record with that probability and --gaps drops out
+whole periods (as from a disconnected sensor), all drawn from a seeded
+generator per stream so runs are repeatable.
+
+At the end the achieved record rate is reported against the target, with
+the largest lag behind schedule, so it is clear when the generator (rather
+than the system under test) is the bottleneck.
+"""
+
+# PIRDS JSON-lines of a simulated scenario, with their times (ms)
+# seed defaults to the scenario's own (see ventos.sim.noise)
+def scenario_records(scenario, seed = None):
+    from ventos.sim import simple
+    if seed is not None:
+        scenario = dict(scenario, seed = seed)
+    with contextlib.redirect_stdout(io.StringIO()): # the simulator reports events
+        pdf = simple.execute_scenario(scenario)
+    handle = io.StringIO()
+    simple.write_PIRDS(pdf, handle)
+    lines = handle.getvalue().split('\n')
+    return [json.loads(line)["ms"] for line in lines], [line.encode() + b'\n' for line in lines]
+
+class StdoutSink:
+    async def open(self):
+        pass
+
+    async def write(self, lines):
+        sys.stdout.buffer.writelines(lines)
+        sys.stdout.buffer.flush() # so paced records arrive when due
+
+    async def close(self):
+        sys.stdout.buffer.flush()
+
+class FileSink:
+    def __init__(self, filename):
+        self.filename = filename
+
+    async def open(self):
+        self.handle = open(self.filename, 'wb')
+
+    async def write(self, lines):
+        self.handle.writelines(lines)
+
+    async def close(self):
+        self.handle.close()
+
+class SocketSink:
+    def __init__(self, host = None, port = None, path = None):
+        self.host, self.port, self.path = host, port, path
+
+    async def open(self):
+        if self.path:
+            self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+        else:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def write(self, lines):
+        self.writer.writelines(lines)
+        await self.writer.drain() # the receiver's flow control paces us
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+# sink for stream i from a spec: -, tcp:host:port, unix:path or a file name
+def sink(spec, i = 0):
+    if spec == '-':
+        return StdoutSink()
+    if spec.startswith('tcp:'):
+        host, port = spec[4:].rsplit(':', 1)
+        return SocketSink(host, int(port))
+    if spec.startswith('unix:'):
+        return SocketSink(path = spec[5:])
+    return FileSink(spec.format(i = i))
+
+# keep mask for records at the given times: each is dropped with probability
+# drop, and gaps (per minute of trace) drop out periods of gap_length seconds
+def dropouts(times, rng, drop = 0, gaps = 0, gap_length = 5):
+    times = np.asarray(times)
+    keep = rng.random(len(times)) >= drop
+    if gaps and len(times):
+        duration = (times[-1] - times[0]) / 60000
+        for start in rng.uniform(times[0], times[-1], rng.poisson(gaps * duration)):
+            keep &= (times < start) | (times >= start + gap_length * 1000)
+    return keep
+
+class Stream:
+    def __init__(self, sink, times, lines, speed = 1, jitter = 0, tick = 10):
+        self.sink = sink
+        self.times = times
+        self.lines = lines
+        self.speed = speed # times real time, 0 for as fast as possible
+        self.jitter = jitter # ms, maximum extra delay per write
+        self.tick = tick # ms between writes when pacing
+        self.sent = 0
+        self.lag = 0.0 # seconds, largest delay behind schedule
+
+    # seconds the records take to play at speed
+    def duration(self):
+        return (self.times[-1] - self.times[0]) / 1000 / self.speed if self.speed and self.times else 0
+
+    async def run(self, rng, chunk = 100):
+        await self.sink.open()
+        times, lines = self.times, self.lines
+        start = time.perf_counter()
+        i = 0
+        while i < len(lines):
+            if self.speed:
+                # send everything due by now (at least one record), then wait a tick
+                due = times[0] + (time.perf_counter() - start) * 1000 * self.speed
+                end = max(i + 1, bisect.bisect_right(times, due))
+                self.lag = max(self.lag, (due - times[i]) / 1000 / self.speed)
+            else:
+                end = i + chunk
+            if self.jitter:
+                await asyncio.sleep(rng.uniform(0, self.jitter) / 1000)
+            await self.sink.write(lines[i:end])
+            self.sent += len(lines[i:end])
+            i = end
+            if self.speed and i < len(lines):
+                wait = start + (times[i] - times[0]) / 1000 / self.speed - time.perf_counter()
+                await asyncio.sleep(max(wait, self.tick / 1000))
+            elif not self.speed:
+                await asyncio.sleep(0) # let the other streams run
+        await self.sink.close()
+
+# play streams records from scenarios to their sinks, returning a report
+async def replay(streams, sink_spec = '-', speed = 1, duration = 240, frequency = 20, jitter = 0,
+                 drop = 0, gaps = 0, gap_length = 5, seed = 0):
+    from ventos.test_trace import scenarios
+    traces = [scenario_records(s) for s in scenarios(duration=duration, sample_frequency=frequency).values()]
+    rngs = np.random.default_rng(seed).spawn(streams)
+    players = []
+    for i, (times, lines), rng in zip(range(streams), itertools.cycle(traces), rngs):
+        keep = dropouts(times, rng, drop, gaps, gap_length)
+        players.append(Stream(sink(sink_spec, i), list(itertools.compress(times, keep)),
+                              list(itertools.compress(lines, keep)), speed, jitter))
+    start = time.perf_counter()
+    await asyncio.gather(*(p.run(rng) for p, rng in zip(players, rngs)))
+    elapsed = time.perf_counter() - start
+    sent = sum(p.sent for p in players)
+    target = sum(p.sent / p.duration() for p in players if p.duration()) if speed else None
+    achieved = sent / elapsed if elapsed else 0
+    return dict(streams=streams, records=sent, seconds=round(elapsed, 3), records_per_second=round(achieved),
+                target_records_per_second=round(target) if target else None,
+                achieved_fraction=round(achieved / target, 3) if target else None,
+                max_lag_seconds=round(max(p.lag for p in players), 3))
+
+# argparse type for counts of at least one
+def positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f'{value} is not at least 1')
+    return value
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='replay simulated PIRDS traces in real time for load testing')
+    parser.add_argument('--streams', type=positive_int, default=1, help='number of simulated ventilators')
+    parser.add_argument('--sink', default='-', help='-, tcp:host:port, unix:path or file name ({i} is the stream)')
+    parser.add_argument('--speed', type=float, default=1, help='times real time, 0 for as fast as possible')
+    parser.add_argument('--duration', type=int, default=240, help='seconds of trace per stream')
+    parser.add_argument('--frequency', type=int, default=20, help='sample frequency (Hz)')
+    parser.add_argument('--jitter', type=float, default=0, help='maximum random delay per write (ms)')
+    parser.add_argument('--drop', type=float, default=0, help='probability of dropping each record')
+    parser.add_argument('--gaps', type=float, default=0, help='dropout periods per minute of trace')
+    parser.add_argument('--gap-length', type=float, default=5, help='seconds per dropout period')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    report = asyncio.run(replay(args.streams, args.sink, args.speed, args.duration, args.frequency,
+                                args.jitter, args.drop, args.gaps, args.gap_length, args.seed))
+    print(json.dumps(report), file=sys.stderr)
+    if report['achieved_fraction'] and report['achieved_fraction'] < 0.95:
+        print('WARNING the generator did not keep up with the target rate', file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3.7
+import sys
+import os.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import ventos # first, see ventos/__init__.py
+import asyncio, json, time, argparse, tempfile, itertools
+from dataclasses import dataclass
+from ventos import signal
+from ventos.stream import TraceStream
+from ventos.replay import scenario_records
+
+"""
+Ingestion server running breath detection on many PIRDS device streams.
+
+Devices connect over TCP or a Unix socket and send PIRDS JSON-lines (as
+written by simple.write_PIRDS), optionally starting with a
+{"event":"hello","device":"<name>"} record to name themselves. Each
+connection gets a ventos.stream.TraceStream, and the breath and alarm events
+it produces are published, tagged with the device name, to subscribers
+(in process with subscribe(), or over a socket with serve_subscribers()).
+
+Each connection's lines go through a bounded queue: when the detector falls
+behind the reader waits for space, so it stops reading and TCP flow control
+slows the device. Queued lines are processed in batches of up to
+batch_size. A slow subscriber never stalls ingestion, its oldest events are
+dropped instead (and counted).
+
+Try it locally with simulated devices (fake_device plays a test trace into
+the server):
+
+    ventos/server.py --demo 200
+    ventos/server.py --port 5555 --publish-port 5556
+"""
+
+@dataclass
+class AlarmLimits:
+    PIP_high: float = 40 # cmH2O
+    PIP_low: float = 8 # cmH2O
+    PEEP_low: float = 2 # cmH2O
+    RR_high: float = 35 # per minute
+    RR_low: float = 6 # per minute
+    apnea: float = 20 # seconds without a breath
+
+    # alarm conditions for a breath event
+    def breath_alarms(self, breath):
+        conditions = {"PIP high": breath["PIP"] > self.PIP_high, "PIP low": breath["PIP"] < self.PIP_low,
+                      "PEEP low": breath["PEEP"] < self.PEEP_low,
+                      "RR high": breath["RR"] > self.RR_high, "RR low": breath["RR"] < self.RR_low}
+        return {alarm for alarm, active in conditions.items() if active}
+
+class Counters:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.connections = 0 # accepted
+        self.open = 0 # currently connected
+        self.records = 0 # PIRDS lines received
+        self.batches = 0
+        self.events = 0 # published
+        self.dropped = 0 # events dropped by full subscriber queues
+        self.bad = 0 # lines that were not valid records, skipped
+        self.errors = 0 # connections closed by a processing error
+        self.latency_total = 0.0 # seconds from reading a line to processing it
+        self.latency_max = 0.0
+
+    def as_dict(self):
+        elapsed = time.perf_counter() - self.start
+        return dict(connections=self.connections, open=self.open, records=self.records, batches=self.batches,
+                    events=self.events, dropped=self.dropped, bad=self.bad, errors=self.errors,
+                    seconds=round(elapsed, 3),
+                    records_per_second=round(self.records / elapsed) if elapsed else 0,
+                    mean_batch=round(self.records / self.batches, 1) if self.batches else 0,
+                    latency_mean_ms=round(1000 * self.latency_total / self.records, 3) if self.records else 0,
+                    latency_max_ms=round(1000 * self.latency_max, 3))
+
+# detection and alarm state for one connection
+class Device:
+    def __init__(self, name, config, limits, type = "P", loc = "I"):
+        self.name = name
+        self.stream = TraceStream(config, type=type, loc=loc)
+        self.limits = limits
+        self.active = set() # alarms currently raised
+        self.last_breath = None # ms
+
+    # process a batch of PIRDS records (dicts), yielding events
+    def feed_batch(self, records):
+        events = self.stream.feed_batch(records)
+        alarms = None
+        for e in events:
+            if e["event"] == "breath":
+                self.last_breath = e["ms"]
+                alarms = self.limits.breath_alarms(e)
+            yield dict(e, device=self.name)
+        latest = self.stream.recent[-1][0] if self.stream.recent else None
+        if latest is None:
+            return
+        if self.last_breath is None:
+            self.last_breath = latest # time apnea from the first sample
+        if alarms is None: # no breath in this batch, keep the breath alarms
+            alarms = self.active - {"apnea"}
+        if latest - self.last_breath > self.limits.apnea * 1000:
+            alarms = alarms | {"apnea"}
+        for alarm in sorted(alarms ^ self.active):
+            yield dict(event="alarm", device=self.name, ms=latest, alarm=alarm, active=alarm in alarms)
+        self.active = alarms
+
+class IngestServer:
+    def __init__(self, config = None, limits = None, queue_size = 1000, batch_size = 100,
+                 subscriber_queue_size = 10000, type = "P", loc = "I", backlog = 1024):
+        self.config = config or signal.VentilatorConfig()
+        self.limits = limits or AlarmLimits()
+        self.queue_size = queue_size # lines buffered per connection
+        self.batch_size = batch_size
+        self.subscriber_queue_size = subscriber_queue_size
+        self.type = type
+        self.loc = loc
+        self.backlog = backlog # pending connections, so many devices can connect at once
+        self.counters = Counters()
+        self.subscribers = []
+        self.devices = {}
+
+    # queue receiving every published event
+    def subscribe(self):
+        queue = asyncio.Queue(self.subscriber_queue_size)
+        self.subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.remove(queue)
+
+    def publish(self, event):
+        self.counters.events += 1
+        for queue in self.subscribers:
+            if queue.full(): # drop the oldest rather than wait for a slow subscriber
+                queue.get_nowait()
+                self.counters.dropped += 1
+            queue.put_nowait(event)
+
+    # connection handler for asyncio.start_server
+    async def handle(self, reader, writer):
+        self.counters.connections += 1
+        self.counters.open += 1
+        device = Device(f"device{self.counters.connections}", self.config, self.limits, self.type, self.loc)
+        queue = asyncio.Queue(self.queue_size)
+        processor = asyncio.ensure_future(self.process(device, queue))
+        # a failed processor stops the reader, which would otherwise wait
+        # forever for space in the queue
+        reading = [asyncio.current_task()]
+        def stop_reading(task):
+            if reading and not task.cancelled() and task.exception() is not None:
+                reading[0].cancel()
+        processor.add_done_callback(stop_reading)
+        failure = None # what closed the connection, if not its end
+        try:
+            try:
+                async for line in reader:
+                    if line.strip():
+                        await queue.put((time.perf_counter(), line)) # waits while the queue is full
+            except ConnectionError:
+                pass
+            except Exception as exc: # reading failed, eg a line longer than the reader's limit
+                failure = exc
+            if failure is None:
+                await queue.put(None) # process what has been read, then finish
+                reading.clear()
+                await processor
+        except asyncio.CancelledError:
+            if not processor.done(): # cancelled from outside, eg the server closing
+                raise
+        except Exception: # the processor failed, reported below
+            pass
+        finally:
+            reading.clear()
+            if not processor.done(): # never left waiting on the queue
+                processor.cancel()
+            elif not processor.cancelled() and processor.exception() is not None:
+                failure = processor.exception()
+            if failure is not None:
+                self.counters.errors += 1
+                print(f'{device.name}: closing connection after {failure!r}', file=sys.stderr)
+            self.devices.pop(device.name, None)
+            self.counters.open -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def process(self, device, queue):
+        self.devices[device.name] = device
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            finished = batch[-1] is None
+            if finished:
+                batch.pop()
+            if batch:
+                self.process_batch(device, batch)
+                await asyncio.sleep(0) # let other connections run between batches
+            if finished:
+                return
+
+    def process_batch(self, device, batch):
+        records = []
+        for _, line in batch:
+            try:
+                record = json.loads(line)
+                if record.get("event") == "M" and not all(isinstance(record[k], (int, float)) for k in ("ms", "val")):
+                    raise TypeError("ms and val must be numbers")
+            except (ValueError, KeyError, TypeError, AttributeError): # not JSON, not an object or a bad measurement
+                self.counters.bad += 1
+                continue
+            if record.get("event") == "hello":
+                self.devices.pop(device.name, None)
+                device.name = str(record.get("device", device.name))
+                self.devices[device.name] = device
+            else:
+                records.append(record)
+        for event in device.feed_batch(records):
+            self.publish(event)
+        now = time.perf_counter()
+        counters = self.counters
+        counters.records += len(batch)
+        counters.batches += 1
+        counters.latency_total += sum(now - received for received, _ in batch)
+        counters.latency_max = max(counters.latency_max, now - batch[0][0])
+
+    # listen for devices on a TCP port or (given path) a Unix socket
+    async def start(self, host = None, port = None, path = None):
+        if path:
+            return await asyncio.start_unix_server(self.handle, path, backlog=self.backlog)
+        return await asyncio.start_server(self.handle, host, port, backlog=self.backlog)
+
+    # write published events as JSON-lines to each connecting client
+    async def serve_subscribers(self, host = None, port = None, path = None):
+        async def handle(reader, writer):
+            queue = self.subscribe()
+            try:
+                while True:
+                    event = await queue.get()
+                    writer.write((json.dumps(event) + '\n').encode())
+                    await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                self.unsubscribe(queue)
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except ConnectionError:
+                    pass
+        if path:
+            return await asyncio.start_unix_server(handle, path)
+        return await asyncio.start_server(handle, host, port)
+
+# a simulated device sending records (from replay.scenario_records) to the server
+# speed is the playback rate relative to real time, 0 as fast as possible
+async def fake_device(name, times, lines, host = None, port = None, path = None, speed = 0, chunk = 20):
+    if path:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    writer.write((json.dumps(dict(event="hello", device=name)) + '\n').encode())
+    start = time.perf_counter()
+    for i in range(0, len(lines), chunk):
+        if speed:
+            delay = start + (times[i] - times[0]) / 1000 / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        writer.writelines(lines[i:i + chunk])
+        await writer.drain() # waits while the server is applying backpressure
+    writer.close()
+
+# run devices simulated devices against a server on a temporary Unix socket,
+# returning the counters and the number of each type of event received
+async def demo(devices, duration = 60, speed = 0, frequency = 20, **server_options):
+    from ventos.test_trace import scenarios
+    traces = [scenario_records(s) for s in scenarios(duration=duration, sample_frequency=frequency).values()]
+    server = IngestServer(signal.VentilatorConfig(sample_frequency=frequency), **server_options)
+    received = {}
+    queue = server.subscribe()
+    async def consume():
+        while True:
+            event = await queue.get()
+            kind = event["event"] if event["event"] != "alarm" else f'alarm {event["alarm"]}'
+            received[kind] = received.get(kind, 0) + 1
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'ingest.sock')
+        listener = await server.start(path=path)
+        consumer = asyncio.ensure_future(consume())
+        trace = itertools.cycle(traces)
+        await asyncio.gather(*(fake_device(f"bed{i}", *next(trace), path=path, speed=speed) for i in range(devices)))
+        # connections close once their queues are processed
+        while server.counters.connections < devices or server.counters.open:
+            await asyncio.sleep(0.01)
+        listener.close()
+        await listener.wait_closed()
+        while not queue.empty():
+            await asyncio.sleep(0)
+        consumer.cancel()
+    return server.counters.as_dict(), received
+
+async def serve(args):
+    server = IngestServer(signal.VentilatorConfig(sample_frequency=args.frequency), AlarmLimits(),
+                          args.queue, args.batch)
+    await server.start(args.host, args.port, args.unix)
+    if args.publish_port or args.publish_unix:
+        await server.serve_subscribers(args.host, args.publish_port, args.publish_unix)
+    else: # publish to stdout
+        queue = server.subscribe()
+        async def write():
+            while True:
+                print(json.dumps(await queue.get()), flush=True)
+        asyncio.ensure_future(write())
+    while True:
+        await asyncio.sleep(args.stats_interval)
+        print(json.dumps(server.counters.as_dict()), file=sys.stderr, flush=True)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='breath detection server for PIRDS JSON-lines device streams')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5555, help='TCP port devices connect to')
+    parser.add_argument('--unix', help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--publish-port', type=int, help='TCP port serving events (default stdout)')
+    parser.add_argument('--publish-unix', help='Unix socket serving events')
+    parser.add_argument('--frequency', type=float, default=20, help='detector sample rate (Hz)')
+    parser.add_argument('--queue', type=int, default=1000, help='lines buffered per connection')
+    parser.add_argument('--batch', type=int, default=100, help='maximum lines processed per batch')
+    parser.add_argument('--stats-interval', type=float, default=10, help='seconds between counters on stderr')
+    parser.add_argument('--demo', type=int, metavar='DEVICES', help='run this many simulated devices and exit')
+    parser.add_argument('--duration', type=int, default=60, help='seconds of trace each demo device sends')
+    parser.add_argument('--speed', type=float, default=0, help='demo playback rate (1 real time, 0 fastest)')
+    args = parser.parse_args(argv)
+    if args.demo:
+        counters, received = asyncio.run(demo(args.demo, args.duration, args.speed, args.frequency,
+                                              queue_size=args.queue, batch_size=args.batch))
+        print(json.dumps(dict(counters, received=received), indent=1))
+    else:
+        asyncio.run(serve(args))
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 import math
-from dataclasses import dataclass, asdict
-import pandas as pd
+from dataclasses import dataclass, replace
+import numpy as np
+from ventos import instrument
+# pandas is only imported by process_trace and resample_trace, so the
+# detector itself needs nothing beyond numpy
 @dataclass
 class VentilatorStatus:
     p: float = 0 # current pressure (cmH2O)
@@ -65,23 +68,253 @@ def step(config, state, p):
         state.vlow = recursive_smooth(config.alphaR, state.vlow, state.p)
         state.Tlow = state.Tlow + 1
 
+# indices of the samples process_trace passes to step()
+# the first sample after each next_time threshold, where next_time starts at
+# -1 ms and advances by 1000 / sample_frequency per accepted sample.
+# The thresholds are accumulated with cumsum, which adds in the same order as
+# the original running total, so the selection is exactly the same.
+def decimation_index(time, sample_frequency):
+    time = np.asarray(time)
+    n = len(time)
+    minimum_time_gap = 1000 / sample_frequency
+    next_time = np.cumsum(np.concatenate(([-1.0], np.full(max(n - 1, 0), minimum_time_gap))))
+    if n > 1 and np.any(np.diff(time) < 0): # unsorted times need a sequential scan
+        index = []
+        for i, t in enumerate(time.tolist()):
+            if t > next_time[len(index)]:
+                index.append(i)
+        return np.array(index, dtype=int)
+    # with sorted times the k-th accepted row is the first after row k-1 that
+    # is past threshold k: index[k] = k + max(first_past[j] - j for j <= k)
+    first_past = np.searchsorted(time, next_time, side='right')
+    k = np.arange(n)
+    index = k + np.maximum.accumulate(first_past - k)
+    return index[index < n]
+
+# array kernel for step(): runs the detector over a sequence of pressures
+# returns a dict of columns (one per VentilatorStatus field) as lists.
+# The state lives in local variables and the arithmetic is written out in the
+# same order as step() and recursive_smooth(), so values (and int/float types)
+# are identical to calling step() on each pressure in turn.
+def step_arrays(config, pressures, state=None):
+    state = state or VentilatorStatus()
+    p, vhigh, vlow, Vhigh, Vlow = state.p, state.vhigh, state.vlow, state.Vhigh, state.Vlow
+    Thigh, Tlow, Tpeak, PIP, PEEP, RR = state.Thigh, state.Tlow, state.Tpeak, state.PIP, state.PEEP, state.RR
+    inhaling = state.inhaling
+    alphaN, alphaA, alphaR, alphaS = config.alphaN, config.alphaA, config.alphaR, config.alphaS
+    delta = config.min_breath_envelope_delta
+    breaths_per_sample = 60 * config.sample_frequency
+    n = len(pressures)
+    columns = {field: [0] * n for field in VentilatorStatus.__dataclass_fields__}
+    cp, cvhigh, cvlow, cVhigh, cVlow = columns['p'], columns['vhigh'], columns['vlow'], columns['Vhigh'], columns['Vlow']
+    cThigh, cTlow, cTpeak = columns['Thigh'], columns['Tlow'], columns['Tpeak']
+    cPIP, cPEEP, cRR, cinhaling = columns['PIP'], columns['PEEP'], columns['RR'], columns['inhaling']
+    for i, new in enumerate(pressures):
+        p = alphaN * p + (1-alphaN) * new
+        Tpeak = Tpeak + 1
+        if p >= vhigh:
+            vhigh = alphaA * vhigh + (1-alphaA) * p
+            Vhigh = p
+            Thigh = 0
+            if not inhaling and vhigh-vlow > delta:
+                inhaling = True
+                PEEP = alphaS * PEEP + (1-alphaS) * Vlow
+        else:
+            vhigh = alphaR * vhigh + (1-alphaR) * p
+            Thigh = Thigh + 1
+        if p <= vlow:
+            vlow = alphaA * vlow + (1-alphaA) * p
+            Vlow = p
+            Tlow = 0
+            if inhaling:
+                inhaling = False
+                PIP = alphaS * PIP + (1-alphaS) * Vhigh
+                if RR > 0:
+                    RR = 1 / (alphaS * (1/RR) + (1-alphaS) * ((Tpeak - Thigh) / breaths_per_sample))
+                else: # modification to prevent division by zero error
+                    RR = breaths_per_sample / (Tpeak - Thigh)
+                Tpeak = Thigh
+        else:
+            vlow = alphaR * vlow + (1-alphaR) * p
+            Tlow = Tlow + 1
+        cp[i] = p; cvhigh[i] = vhigh; cvlow[i] = vlow; cVhigh[i] = Vhigh; cVlow[i] = Vlow
+        cThigh[i] = Thigh; cTlow[i] = Tlow; cTpeak[i] = Tpeak
+        cPIP[i] = PIP; cPEEP[i] = PEEP; cRR[i] = RR; cinhaling[i] = inhaling
+    state.p, state.vhigh, state.vlow, state.Vhigh, state.Vlow = p, vhigh, vlow, Vhigh, Vlow
+    state.Thigh, state.Tlow, state.Tpeak, state.PIP, state.PEEP, state.RR = Thigh, Tlow, Tpeak, PIP, PEEP, RR
+    state.inhaling = inhaling
+    return columns
+
+# the detector for many channels (eg a ward of ventilators) at once
+# state is held as one array per VentilatorStatus field (struct of arrays),
+# and each channel has its own VentilatorConfig. step() advances every channel
+# by one sample and step_block() by a block of samples, with the arithmetic of
+# step() applied elementwise, so each channel's values are identical to
+# running step() on it alone.
+class VentilatorFleet:
+    def __init__(self, configs, states=None):
+        self.configs = list(configs)
+        n = len(self.configs)
+        states = states or [VentilatorStatus() for _ in range(n)]
+        def setting(name):
+            return np.array([getattr(c, name) for c in self.configs], dtype=float)
+        self.alphaN, self.alphaA = setting('alphaN'), setting('alphaA')
+        self.alphaR, self.alphaS = setting('alphaR'), setting('alphaS')
+        self.delta = setting('min_breath_envelope_delta')
+        self.breaths_per_sample = 60 * setting('sample_frequency')
+        for field in VentilatorStatus.__dataclass_fields__:
+            dtype = bool if field == 'inhaling' else int if field[0] == 'T' else float
+            setattr(self, field, np.array([getattr(s, field) for s in states], dtype=dtype))
+
+    def __len__(self):
+        return len(self.configs)
+
+    # VentilatorStatus of channel i
+    def status(self, i):
+        return VentilatorStatus(**{field: getattr(self, field)[i].item() for field in VentilatorStatus.__dataclass_fields__})
+
+    # advance every channel by one sample, pressures has one value per channel
+    def step(self, pressures):
+        aN, aA, aR, aS = self.alphaN, self.alphaA, self.alphaR, self.alphaS
+        p = self.p = aN * self.p + (1-aN) * np.asarray(pressures, dtype=float)
+        self.Tpeak = self.Tpeak + 1
+        high = p >= self.vhigh
+        self.vhigh = np.where(high, aA * self.vhigh + (1-aA) * p, aR * self.vhigh + (1-aR) * p)
+        self.Vhigh = np.where(high, p, self.Vhigh)
+        self.Thigh = np.where(high, 0, self.Thigh + 1)
+        starting = high & ~self.inhaling & (self.vhigh-self.vlow > self.delta)
+        self.PEEP = np.where(starting, aS * self.PEEP + (1-aS) * self.Vlow, self.PEEP)
+        low = p <= self.vlow
+        self.vlow = np.where(low, aA * self.vlow + (1-aA) * p, aR * self.vlow + (1-aR) * p)
+        self.Vlow = np.where(low, p, self.Vlow)
+        self.Tlow = np.where(low, 0, self.Tlow + 1)
+        ending = low & (self.inhaling | starting)
+        self.inhaling = (self.inhaling | starting) & ~ending
+        if ending.any():
+            self.PIP = np.where(ending, aS * self.PIP + (1-aS) * self.Vhigh, self.PIP)
+            interval = self.Tpeak - self.Thigh
+            with np.errstate(divide='ignore', invalid='ignore'): # only the ending channels are kept
+                smoothed = 1 / (aS * (1/self.RR) + (1-aS) * (interval / self.breaths_per_sample))
+                first = self.breaths_per_sample / interval
+            self.RR = np.where(ending, np.where(self.RR > 0, smoothed, first), self.RR)
+            self.Tpeak = np.where(ending, self.Thigh, self.Tpeak)
+
+    # advance every channel through a block of samples, pressures has shape
+    # (samples, channels). Returns a dict of (samples, channels) arrays, one
+    # per VentilatorStatus field
+    def step_block(self, pressures):
+        pressures = np.asarray(pressures, dtype=float)
+        columns = {field: np.empty(pressures.shape, dtype=getattr(self, field).dtype)
+                   for field in VentilatorStatus.__dataclass_fields__}
+        for i, sample in enumerate(pressures):
+            self.step(sample)
+            for field, column in columns.items():
+                column[i] = getattr(self, field)
+        return columns
+
+# anti-aliased decimation of a stream of samples to frequency (Hz)
+# The samples in each block of 1000 / frequency ms (counted from time 0) are
+# averaged, a low-pass filter with nulls at multiples of frequency, so noise
+# and cardiac oscillation faster than the detector rate are averaged out
+# rather than aliased into it. Output times are the block starts (ms), and
+# blocks without samples (gaps, dropped records) give no output. values may
+# be (n,) or (n, channels).
+# feed() takes a stream in time ordered chunks and returns the completed
+# blocks: the samples of the last block are held until a later sample (or
+# flush()) closes it, and summed with the rest of their block in the same
+# order, so the output is identical to resampling the whole stream at once.
+class Resampler:
+    def __init__(self, frequency):
+        self.period = 1000 / frequency # ms
+        self.times = np.empty(0)
+        self.values = None # samples of the open block
+        self.shape = () # of each value, so an empty flush matches what was fed
+
+    def feed(self, times, values):
+        times = np.asarray(times, dtype=float)
+        values = np.asarray(values, dtype=float)
+        self.shape = values.shape[1:]
+        if self.values is not None:
+            times = np.concatenate((self.times, times))
+            values = np.concatenate((self.values, values))
+        if not len(times):
+            return times, values
+        block = np.floor(times / self.period).astype(np.int64)
+        held = np.searchsorted(block, block[-1]) # first sample of the last block
+        self.times, self.values = times[held:], values[held:]
+        return self.average(block[:held], values[:held])
+
+    # output the open block, at the end of the stream
+    def flush(self):
+        if self.values is None:
+            return np.empty(0), np.empty((0,) + self.shape)
+        times, values = self.times, self.values
+        self.times, self.values = np.empty(0), None
+        return self.average(np.floor(times / self.period).astype(np.int64), values)
+
+    def average(self, block, values):
+        if not len(block):
+            return np.empty(0), values[:0]
+        offset = block - block[0]
+        counts = np.bincount(offset)
+        kept = counts > 0
+        if values.ndim == 1:
+            means = np.bincount(offset, weights=values)[kept] / counts[kept]
+        else:
+            means = np.column_stack([np.bincount(offset, weights=column)[kept] / counts[kept] for column in values.T])
+        return (np.flatnonzero(kept) + block[0]) * self.period, means
+
+# config for running the detector at frequency (Hz): alphaA, alphaR and alphaN
+# are retuned (retune_alpha) from config.sample_frequency, keeping their time
+# constants in seconds. alphaS smooths once per breath, not per sample, so it
+# is independent of the rate and kept
+def retuned(config, frequency):
+    alphas = {name: retune_alpha(getattr(config, name), frequency, config.sample_frequency)
+              for name in ['alphaA', 'alphaR', 'alphaN']}
+    result = replace(config, sample_frequency=frequency, **alphas)
+    result.min_breath_envelope_delta = config.min_breath_envelope_delta
+    return result
+
+# trace (a dataframe with time in ms) resampled to frequency by Resampler,
+# columns defaults to all but time
+def resample_trace(trace, frequency, columns=None):
+    import pandas as pd
+    columns = columns or [c for c in trace.columns if c != 'time']
+    resampler = Resampler(frequency)
+    times, values = resampler.feed(trace['time'].to_numpy(), trace[columns].to_numpy(dtype=float))
+    last_times, last_values = resampler.flush()
+    values = np.concatenate((values, last_values)).reshape(-1, len(columns))
+    return pd.DataFrame(dict(time=np.concatenate((times, last_times)), **dict(zip(columns, values.T))))
+
 # take a waveform and apply signal proccessing algorithm
 # returns a Pandas data frame
-def process_trace(trace, config, pressure_column="pressure"):
-    next_time = -1 # ms
-    minimum_time_gap = 1000 / config.sample_frequency
-    vs = VentilatorStatus()
-    sp = [] # container for processed signals
-    for i, row in trace.iterrows():
-        p = row[pressure_column]
-        t = row.time
-        if t > next_time:
-            step(config, vs, p)
-            sp.append(dict(asdict(vs), time=t))
-            next_time += minimum_time_gap
-    results = pd.DataFrame.from_records(sp)
-    results['time_s'] = results['time'] / 1000
-    results['phase'] = results['inhaling'].astype(int) * 10 + 5
+# stats is an optional ventos.instrument.Stats
+# resample False keeps the first sample after each detector period, True
+# averages each period (resample_trace), and a rate in Hz resamples to that
+# rate and runs the detector there with config retuned()
+def process_trace(trace, config, pressure_column="pressure", stats=None, resample=False):
+    import pandas as pd
+    stats = stats or instrument.null
+    if resample:
+        if resample is not True and resample != config.sample_frequency:
+            config = retuned(config, resample)
+        with stats.stage('process_trace.resample'):
+            resampled = resample_trace(trace, config.sample_frequency, [pressure_column])
+            times, pressures = resampled['time'].to_numpy(), resampled[pressure_column].to_numpy()
+    else:
+        with stats.stage('process_trace.decimate'):
+            # iterrows hands step() values of the frame's common row dtype
+            row_dtype = trace.iloc[:1].to_numpy().dtype
+            index = decimation_index(trace['time'].to_numpy(), config.sample_frequency)
+            pressures = trace[pressure_column].to_numpy().astype(row_dtype)[index]
+            times = trace['time'].to_numpy().astype(row_dtype)[index]
+    with stats.stage('process_trace.step'):
+        columns = step_arrays(config, pressures.tolist())
+    with stats.stage('process_trace.dataframe'):
+        columns['time'] = times.tolist()
+        results = pd.DataFrame(columns)
+        results['time_s'] = results['time'] / 1000
+        results['phase'] = results['inhaling'].astype(int) * 10 + 5
     return results
 
 """
@@ -0,0 +1,131 @@
+import math, collections, pandas as pd
+from ventos import instrument
+from ventos.lung import pressure_from_volume
+from ventos.sim.simple import Patient_log
+from ventos.sim.schedule import EventScheduler, event_target
+
+"""
+Adaptive step integrator for the simple lung model.
+
+In pressure control the mouth pressure is constant between ventilator phase
+changes, and within such a segment the lung volume follows the smooth ODE
+
+    dV/dt = (pressure_mouth - pressure_alveolus(V)) / resistance
+
+This integrates each segment with an embedded Runge-Kutta 3(2) pair
+(Bogacki-Shampine) with step size control, stopping exactly on phase changes
+and scheduled events, and resamples onto the requested time_resolution grid
+with cubic Hermite interpolation. It converges to the same solution as the
+fixed step Euler loop in ventos.sim.simple as that loop's time_resolution is
+reduced, with far fewer model evaluations.
+"""
+
+# small time (ms) used to decide which side of a phase boundary a time is on
+boundary_tolerance = 1e-6
+
+# ventilator phase on the interval starting at time (ms), and when it ends
+def phase_interval(ventilator, time):
+    breath_length = 60000 / ventilator.rate # milliseconds
+    inspiration_length = breath_length * ventilator.IE / (ventilator.IE + 1)
+    breath_start = math.floor((time + boundary_tolerance) / breath_length) * breath_length
+    if time - breath_start + boundary_tolerance < inspiration_length:
+        return "I", breath_start + inspiration_length
+    return "E", breath_start + breath_length
+
+# stats is an optional ventos.instrument.Stats
+class AdaptiveLoop:
+    def __init__(self, patient, ventilator, rtol = 1e-6, atol = 1e-6, stats = None):
+        self.patient = patient
+        self.ventilator = ventilator
+        self.rtol = rtol
+        self.atol = atol # ml
+        self.stats = stats or instrument.null
+        self.evaluations = 0 # number of model (flow) evaluations
+
+    def pressure_alveolus(self, volume):
+        return pressure_from_volume(volume * 100 / self.patient.TLC, self.patient.compliance)
+
+    def flow(self, volume, pressure_mouth):
+        self.evaluations += 1
+        return (pressure_mouth - self.pressure_alveolus(volume)) / self.patient.resistance # ml/ms
+
+    def record(self, time, volume, pressure_mouth):
+        pressure_alveolus = self.pressure_alveolus(volume)
+        return Patient_log(time, pressure_mouth, pressure_alveolus,
+                           pressure_from_volume(volume * 100 / self.patient.TLC, "Chest"),
+                           volume, (pressure_mouth - pressure_alveolus) / self.patient.resistance)
+
+    # integrate from time to segment_end at constant pressure_mouth, appending
+    # records for the grid times that fall in (time, segment_end)
+    def segment(self, time, segment_end, volume, pressure_mouth, grid, log, h):
+        k1 = self.flow(volume, pressure_mouth)
+        while segment_end - time > boundary_tolerance:
+            h = min(h, segment_end - time)
+            k2 = self.flow(volume + h / 2 * k1, pressure_mouth)
+            k3 = self.flow(volume + 3 * h / 4 * k2, pressure_mouth)
+            new_volume = volume + h * (2 / 9 * k1 + 1 / 3 * k2 + 4 / 9 * k3)
+            k4 = self.flow(new_volume, pressure_mouth)
+            error = abs(h * (-5 / 72 * k1 + 1 / 12 * k2 + 1 / 9 * k3 - 1 / 8 * k4))
+            tolerance = self.atol + self.rtol * abs(new_volume)
+            if error <= tolerance:
+                new_time = segment_end if segment_end - (time + h) <= boundary_tolerance else time + h
+                while grid and grid[0] < new_time - boundary_tolerance:
+                    s = (grid[0] - time) / h # cubic hermite dense output
+                    v = ((2 * s**3 - 3 * s**2 + 1) * volume + (s**3 - 2 * s**2 + s) * h * k1
+                         + (-2 * s**3 + 3 * s**2) * new_volume + (s**3 - s**2) * h * k4)
+                    log.append(self.record(grid.popleft(), v, pressure_mouth))
+                time, volume, k1 = new_time, new_volume, k4
+            h = h * min(5, max(0.2, 0.9 * (tolerance / error) ** (1 / 3) if error else 5))
+        return volume, h
+
+    # run from start_time to end_time (ms) with output every time_resolution
+    # returns a dataframe like simple.loop
+    def run(self, start_time = 0, end_time = 20000, time_resolution = 50, events = []):
+        patient, ventilator = self.patient, self.ventilator
+        segment = self.stats.timed('adaptive.segment', self.segment)
+        patient.advance(advance_time = 0) # first record matches simple.loop
+        log = [patient.status()]
+        grid = collections.deque(t + time_resolution for t in range(start_time, end_time, time_resolution))
+        schedule = EventScheduler(events)
+        end = grid[-1] if grid else start_time
+        time, volume, h = start_time, patient.lung_volume, time_resolution
+        pressure_mouth = ventilator.pressure_mouth
+        # the ventilator only changes its output when the phase changes
+        def update_phase(pressure_mouth):
+            new_phase, phase_end = phase_interval(ventilator, time)
+            if new_phase != ventilator.phase:
+                ventilator.phase = new_phase
+                pressure_mouth = ventilator.pressure = ventilator.target_pressure()
+            return pressure_mouth, phase_end
+        while True:
+            pressure_mouth, phase_end = update_phase(pressure_mouth)
+            # grid times on a boundary report the new phase, as simple.loop does
+            while grid and grid[0] <= time + boundary_tolerance:
+                log.append(self.record(grid.popleft(), volume, pressure_mouth))
+            if time >= end - boundary_tolerance:
+                break
+            # events take effect after the phase change at the same time, as
+            # simple.loop applies them after the step
+            due = schedule.pop_due(time + boundary_tolerance)
+            for e in due:
+                print(f'Event at {time}ms setting {e["attr"]} to {e["val"]}')
+                setattr(event_target(e, patient, ventilator), e["attr"], e["val"])
+            if due:
+                pressure_mouth, phase_end = update_phase(pressure_mouth)
+            segment_end = max(time, min(phase_end, schedule.next_time(), end))
+            volume, h = segment(time, segment_end, volume, pressure_mouth, grid, log, h)
+            time = segment_end
+        if log[1:]:
+            patient.time, patient.pressure_mouth, patient.pressure_alveolus, patient.pressure_intrapleural, \
+                patient.lung_volume, patient.flow = log[-1]
+        patient.log.extend(log[1:])
+        ventilator.time = patient.time
+        ventilator.pressure_mouth = pressure_mouth
+        if len(schedule):
+            print(f'WARNING {len(schedule)} unprocessed')
+        with self.stats.stage('loop.dataframe'):
+            return pd.DataFrame.from_records(log, columns=Patient_log._fields)
+
+def loop(patient, ventilator,
+        start_time = 0, end_time = 20000, time_resolution = 50, events = [], rtol = 1e-6, atol = 1e-6, stats = None):
+    return AdaptiveLoop(patient, ventilator, rtol, atol, stats).run(start_time, end_time, time_resolution, events)
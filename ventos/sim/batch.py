@@ -0,0 +1,209 @@
+import math, numpy as np, pandas as pd
+from ventos.lung import switch_v_p_vectorized, switch_p_v_vectorized
+from ventos.sim.simple import Patient_log, decorate_sim
+from ventos.sim.schedule import event_time
+
+"""
+Batched version of the simple simulator.
+
+Holds the state of many patient/ventilator pairs as numpy arrays (one row per
+scenario) and advances them all in lockstep with one vectorized step, so a
+whole set of scenarios or a parameter sweep runs in a single python loop.
+Each step does the same arithmetic as Patient.advance and Ventilator.advance,
+so the per-scenario results match simple.execute_scenario.
+"""
+
+class PatientBatch:
+    # scenario attributes that events can change on the patient
+    settings = ['resistance', 'compliance']
+    curves = list(switch_p_v_vectorized) # compliance is stored as an index into this list
+
+    # compliance is a curve name, or a list of one per row
+    def __init__(self, resistance, pressure_mouth, TLC = 6000, compliance = "Total"):
+        resistance = np.array(resistance, dtype=float)
+        n = len(resistance)
+        self.time = 0 # miliseconds
+        self.TLC = np.broadcast_to(np.asarray(TLC, dtype=float), (n,)).copy()
+        self.pressure_mouth = np.broadcast_to(np.asarray(pressure_mouth, dtype=float), (n,)).copy()
+        self.resistance = resistance
+        compliance = [compliance] * n if isinstance(compliance, str) else compliance
+        self.compliance = np.array([self.curves.index(curve) for curve in compliance], dtype=int)
+        self.pressure_alveolus = self.pressure_mouth.copy() # start at equlibrium
+        v_percent = self.by_curve(switch_v_p_vectorized, self.pressure_alveolus)
+        self.lung_volume = self.TLC * v_percent / 100
+        self.pressure_intrapleural = switch_p_v_vectorized['Chest'](v_percent)
+        self.flow = np.zeros(n)
+
+    def advance(self, advance_time, pressure_mouth):
+        self.time = self.time + advance_time # miliseconds
+        self.pressure_mouth = pressure_mouth
+        gradient = pressure_mouth - self.pressure_alveolus
+        self.flow = gradient / self.resistance # l/second or ml/ms
+        self.lung_volume = self.lung_volume + self.flow * advance_time
+        v_percent = self.lung_volume * 100 / self.TLC
+        self.pressure_alveolus = self.by_curve(switch_p_v_vectorized, v_percent)
+        self.pressure_intrapleural = switch_p_v_vectorized['Chest'](v_percent)
+
+    # apply each row's own compliance curve from one of the ventos.lung switches
+    def by_curve(self, switch, x):
+        if not self.compliance.any(): # all rows on the first ("Total") curve
+            return switch[self.curves[0]](x)
+        result = np.empty_like(x)
+        for curve in np.unique(self.compliance):
+            rows = self.compliance == curve
+            result[rows] = switch[self.curves[curve]](x[rows])
+        return result
+
+
+class VentilatorBatch:
+    # scenario attributes that events can change on the ventilator
+    settings = ['Pi', 'PEEP', 'rate', 'IE']
+
+    def __init__(self, Pi, PEEP, rate, IE):
+        self.Pi = np.array(Pi, dtype=float)
+        n = len(self.Pi)
+        self.PEEP = np.broadcast_to(np.asarray(PEEP, dtype=float), (n,)).copy()
+        self.rate = np.broadcast_to(np.asarray(rate, dtype=float), (n,)).copy()
+        self.IE = np.broadcast_to(np.asarray(IE, dtype=float), (n,)).copy()
+        self.pressure = np.zeros(n)
+        self.pressure_mouth = np.zeros(n)
+        self.inspiring = np.zeros(n, dtype=bool) # phase "I" if True else "E"
+        self.time = 0 # miliseconds
+
+    def advance(self, advance_time, pressure_mouth):
+        self.time = self.time + advance_time # miliseconds
+        breath_length = 60000 / self.rate # milliseconds
+        time_since_inspiration_began = self.time % breath_length
+        inspiration_length = breath_length * self.IE / (self.IE + 1)
+        new_phase = time_since_inspiration_began < inspiration_length
+        changed = new_phase != self.inspiring
+        self.inspiring = new_phase
+        target = np.where(new_phase, self.Pi, self.PEEP)
+        self.pressure = np.where(changed, target, self.pressure)
+        self.pressure_mouth = np.where(changed, target, pressure_mouth) # assume perfect ventilator
+        return self.pressure_mouth
+
+
+# targets and attributes that events can change in a batch
+def batch_settings(patients):
+    return [('ventilator', attr) for attr in VentilatorBatch.settings] + \
+           [('patient', attr) for attr in patients.settings]
+
+# index into settings (from batch_settings) for an event, following the rules
+# of schedule.event_target, or -1 for attributes a batch does not model
+def batch_setting(e, settings):
+    targets = [e['target']] if 'target' in e else ['ventilator', 'patient']
+    for target in targets:
+        if (target, e['attr']) in settings:
+            return settings.index((target, e['attr']))
+    return -1
+
+# pack each scenario's event list into padded arrays, sorted by time
+# fire holds the index of the step after which each event is applied (the
+# first step starting at or past the event time, as in simple.loop)
+def event_table(event_lists, start_time, time_resolution, settings):
+    n = len(event_lists)
+    width = max([len(events) for events in event_lists] + [0]) + 1 # sentinel column
+    fire = np.full((n, width), np.iinfo(np.int64).max)
+    index = np.full((n, width), -1)
+    vals = np.zeros((n, width))
+    for row, events in enumerate(event_lists):
+        for col, e in enumerate(sorted(events, key=event_time)):
+            fire[row, col] = max(0, math.ceil((event_time(e) - start_time) / time_resolution))
+            index[row, col] = batch_setting(e, settings)
+            value = e['val']
+            if e['attr'] == 'compliance':
+                value = PatientBatch.curves.index(value)
+            vals[row, col] = value
+    return fire, index, vals
+
+# advance a batch of patients and ventilators in lockstep
+# events is a list (one per row) of event lists as used by simple.loop
+# returns a dict of (steps+1, rows) arrays keyed by Patient_log field
+def loop(patients, ventilators,
+        start_time = 0, end_time = 20000, time_resolution = 50, events = None):
+    n = len(patients.resistance)
+    settings = batch_settings(patients)
+    fire, setting_index, vals = event_table(events or [[]] * n, start_time, time_resolution, settings)
+    rows = np.arange(n)
+    next_event = np.zeros(n, dtype=int)
+    objects = dict(ventilator=ventilators, patient=patients)
+    steps = len(range(start_time, end_time, time_resolution))
+    log = {field: np.empty((steps + 1, n)) for field in Patient_log._fields}
+    def record(i):
+        log['time'][i] = patients.time
+        log['pressure_mouth'][i] = patients.pressure_mouth
+        log['pressure_alveolus'][i] = patients.pressure_alveolus
+        log['pressure_intrapleural'][i] = patients.pressure_intrapleural
+        log['lung_volume'][i] = patients.lung_volume
+        log['flow'][i] = patients.flow
+    patients.advance(advance_time = 0, pressure_mouth = np.zeros(n))
+    record(0)
+    for i in range(steps):
+        pressure_mouth = ventilators.advance(time_resolution, patients.pressure_mouth)
+        patients.advance(time_resolution, pressure_mouth)
+        record(i + 1)
+        # apply every event due after this step, one column at a time
+        due = fire[rows, next_event] == i
+        while due.any():
+            setting = setting_index[rows, next_event]
+            val = vals[rows, next_event]
+            for k, (target, attr) in enumerate(settings):
+                hit = due & (setting == k)
+                if hit.any():
+                    values = getattr(objects[target], attr)
+                    values[hit] = val[hit]
+            next_event += due
+            due = fire[rows, next_event] == i
+    unprocessed = (fire[rows, next_event] < np.iinfo(np.int64).max).sum()
+    if unprocessed:
+        print(f'WARNING {unprocessed} unprocessed')
+    return log
+
+# simple.loop logs the ventilator settings as given, so a simple Patient's
+# pressure_mouth is an integer column when every pressure setting in the
+# scenario is an integer
+def integer_pressures(s):
+    values = [s['Pi'], s['PEEP']] + [e['val'] for e in s['events'] if e['attr'] in ('Pi', 'PEEP')]
+    return all(isinstance(value, (int, np.integer)) for value in values)
+
+# batch of patients for a group of scenarios using the same patient model
+def patient_batch(patient, group):
+    if patient == 'collapsible':
+        from ventos.sim.collapsible import CollapsiblePatients
+        return CollapsiblePatients(resistance=[s['resistance'] for _, s in group],
+                                   pressure_mouth=[s['PEEP'] for _, s in group],
+                                   Pmus=[s.get('Pmus', 0) for _, s in group])
+    return PatientBatch(resistance=[s['resistance'] for _, s in group],
+                        pressure_mouth=[s['PEEP'] for _, s in group],
+                        compliance=[s.get('compliance', 'Total') for _, s in group])
+
+# execute many scenarios (a list, or a dict as returned by test_trace.scenarios)
+# in lockstep, one batch per time_resolution and patient model
+# returns the same container holding the dataframe execute_scenario would give
+def execute_scenarios(scenarios):
+    items = list(scenarios.items()) if isinstance(scenarios, dict) else list(enumerate(scenarios))
+    results = {}
+    batches = sorted(set((s['time_resolution'], s.get('patient', 'simple')) for _, s in items))
+    for time_resolution, patient in batches:
+        group = [(key, s) for key, s in items
+                 if (s['time_resolution'], s.get('patient', 'simple')) == (time_resolution, patient)]
+        p = patient_batch(patient, group)
+        v = VentilatorBatch(Pi=[s['Pi'] for _, s in group],
+                            PEEP=[s['PEEP'] for _, s in group],
+                            rate=[s['rate'] for _, s in group],
+                            IE=[s['IE'] for _, s in group])
+        end_time = max(s['end_time'] for _, s in group) * 1000
+        log = loop(p, v, end_time = end_time, time_resolution = time_resolution,
+                   events = [s['events'] for _, s in group])
+        for row, (key, s) in enumerate(group):
+            length = len(range(0, s['end_time'] * 1000, time_resolution)) + 1
+            pdf = pd.DataFrame({field: log[field][:length, row] for field in Patient_log._fields})
+            pdf['time'] = pdf['time'].astype(int)
+            if patient == 'simple' and integer_pressures(s):
+                pdf['pressure_mouth'] = pdf['pressure_mouth'].astype(int)
+            decorate_sim(pdf, s)
+            results[key] = pdf
+    if isinstance(scenarios, dict):
+        return {key: results[key] for key, _ in items}
+    return [results[key] for key, _ in items]
@@ -0,0 +1,128 @@
+import numpy as np
+from ventos import model as m
+from ventos.sim.simple import Patient_log, Log
+
+"""
+Patient with a collapsible airway, built on the parameters and equations of
+ventos/model.py.
+
+Gas flows from the mouth through the upper airway (RU, plus an optional
+series resistance such as an endotracheal tube), the collapsible airway (RC,
+set by its volume VC, which depends on its transmural pressure) and the small
+airways (RS) into the alveoli. The alveolar volume VA is the state. The
+collapsible airway is treated as quasi-static, so at each step the pressure
+PC inside it is found where the flow through the upper and collapsible
+airways equals the flow through the small airways (by the Illinois method on
+arrays, which reaches machine precision in 10 steps). When the pleural
+pressure exceeds PC during expiration (eg with expiratory muscle effort,
+Pmus) the airway narrows and its resistance rises steeply, which
+limits expiratory flow.
+
+Units follow model.py (l, l/s, cmH2O) except at the interface, where the
+patient logs lung volume in ml like ventos.sim.simple.Patient (flow in l/s is
+the same as ml/ms).
+
+CollapsiblePatients holds many patients as arrays (usable with
+ventos.sim.batch.loop), CollapsiblePatient is a single patient for
+simple.loop.
+"""
+
+bisection_steps = 40
+
+# solve g(x) = 0 for x between lo and hi, where g(lo) >= 0 >= g(hi)
+def bisect(g, lo, hi, steps = bisection_steps):
+    for _ in range(steps):
+        mid = (lo + hi) / 2
+        positive = g(mid) > 0
+        lo = np.where(positive, mid, lo)
+        hi = np.where(positive, hi, mid)
+    return (lo + hi) / 2
+
+# as bisect, but by the Illinois (modified false position) method, which
+# converges superlinearly so far fewer evaluations of g are needed
+def illinois(g, lo, hi, steps = 12):
+    glo, ghi = g(lo), g(hi)
+    side = np.zeros(lo.shape)
+    for _ in range(steps):
+        span = glo - ghi
+        x = np.where(span > 0, lo + glo * (hi - lo) / np.where(span > 0, span, 1), lo)
+        gx = g(x)
+        positive = gx > 0
+        # halve the value kept at an end that has been retained twice running
+        ghi = np.where(positive & (side > 0), ghi / 2, ghi)
+        glo = np.where(~positive & (side < 0), glo / 2, glo)
+        lo, glo = np.where(positive, x, lo), np.where(positive, gx, glo)
+        hi, ghi = np.where(positive, hi, x), np.where(positive, ghi, gx)
+        side = np.where(positive, 1, -1)
+    return np.where(np.abs(glo) < np.abs(ghi), lo, hi)
+
+# flow (l/s) through a Rohrer resistance a + Ku|F| (plus RU's fixed part)
+# for a pressure drop D: the root of Ku F|F| + a F - D = 0
+def rohrer_flow(a, D):
+    return np.sign(D) * 2 * np.abs(D) / (a + np.sqrt(a * a + 4 * m.Ku * np.abs(D)))
+
+class CollapsiblePatients:
+    # attributes that scenario events can change (see ventos.sim.batch)
+    settings = ['resistance', 'Pmus']
+
+    def __init__(self, pressure_mouth, resistance = 0, Pmus = 0):
+        self.pressure_mouth = np.array(pressure_mouth, dtype=float, ndmin=1)
+        n = len(self.pressure_mouth)
+        self.time = 0 # miliseconds
+        self.resistance = np.broadcast_to(np.asarray(resistance, dtype=float), (n,)).copy() # series cmH2O/l/s
+        self.Pmus = np.broadcast_to(np.asarray(Pmus, dtype=float), (n,)).copy() # muscular pressure, +ve expiratory
+        # start at equilibrium: no flow, so alveolar pressure equals the mouth
+        # pressure and the collapsible airway transmural pressure is Pl
+        def excess(VA):
+            return self.pressure_mouth - m.Pl(VA) - m.Pcw(self.lung_volume_l(VA, m.Pl(VA))) - self.Pmus
+        self.VA = bisect(excess, np.full(n, m.VR - m.VD), np.full(n, m.TLC - m.VD - m.VCmax), 60)
+        self.Ptm = m.Pl(self.VA)
+        CollapsiblePatients.advance(self, 0, self.pressure_mouth)
+
+    # total lung volume (l) for alveolar volume VA and collapsible airway
+    # transmural pressure Ptm
+    def lung_volume_l(self, VA, Ptm):
+        return VA + m.VC_vectorized(Ptm) + m.VD
+
+    def advance(self, advance_time, pressure_mouth):
+        self.time = self.time + advance_time # miliseconds
+        self.pressure_mouth = pressure_mouth
+        VA = self.VA
+        Pel = m.Pl(VA)
+        # pleural pressure from the chest wall and muscles, using the
+        # collapsible airway volume from the previous step
+        Ppl = m.Pcw(self.lung_volume_l(VA, self.Ptm)) + self.Pmus
+        resistance_small = m.RS(VA) + m.RLT
+        def flow_upper(PC):
+            a = m.Au + m.RC(m.VC_vectorized(PC - Ppl)) + self.resistance
+            return rohrer_flow(a, pressure_mouth - PC)
+        def mismatch(PC):
+            return flow_upper(PC) - (PC - Pel - Ppl) / resistance_small
+        static = Pel + Ppl
+        PC = illinois(mismatch, np.minimum(pressure_mouth, static), np.maximum(pressure_mouth, static), 10)
+        self.flow = (PC - static) / resistance_small # l/s or ml/ms, into the alveoli
+        self.PC = PC
+        self.Ptm = PC - Ppl
+        self.VA = VA + self.flow * advance_time / 1000
+        # report the state at the end of the step, as simple.Patient does
+        lung_volume = self.lung_volume_l(self.VA, self.Ptm)
+        self.pressure_intrapleural = m.Pcw(lung_volume) + self.Pmus
+        self.pressure_alveolus = m.Pl(self.VA) + self.pressure_intrapleural + m.RLT * self.flow
+        self.lung_volume = lung_volume * 1000 # ml
+
+
+# a single collapsible airway patient, with the interface of simple.Patient
+class CollapsiblePatient(CollapsiblePatients):
+    def __init__(self, pressure_mouth = 0, resistance = 0, Pmus = 0):
+        super().__init__([pressure_mouth], resistance, Pmus)
+        self.log = Log(Patient_log)
+
+    def status(self):
+        return Patient_log(self.time, self.pressure_mouth[0], self.pressure_alveolus[0], self.pressure_intrapleural[0],
+                           self.lung_volume[0], self.flow[0])
+
+    def advance(self, advance_time = 200, pressure_mouth = 0):
+        super().advance(advance_time, np.array(pressure_mouth, dtype=float, ndmin=1))
+        status = self.status()
+        self.log.append(status)
+        return status
@@ -0,0 +1,118 @@
+import zlib, numpy as np
+
+"""
+Reproducible sensor noise and artifacts for simulated traces.
+
+Random numbers come from a numpy Philox (counter based) generator keyed on
+the scenario's seed and a substream number. The samples of a trace are
+split into blocks of block_size rows, and block k is always drawn from the
+generator jumped k times, so the numbers for any window of rows can be
+drawn on their own (eg one chunk of a streamed run, or one worker's share of
+a parallel one) and are bit for bit those of a sequential run over the whole
+trace. Each block draws all channels in a single call.
+
+The sensor model is configured by optional scenario keys:
+
+    flow_noise_sd, pressure_noise_sd   gaussian noise (l/s, cmH2O)
+    heart_rate, cardiac_amplitude      cardiac oscillation of the flow
+    cardiac_harmonics                  relative amplitudes of the fundamental
+                                       and its harmonics, default [1]
+    pressure_quantum, flow_quantum     sensor resolution (0 for none)
+    pressure_drift, flow_drift         amplitude of a slow sinusoidal offset
+    drift_period                       of the drift (s), default 300
+    dropout_rate                       chance a sensor drops out at a sample
+    dropout_length                     seconds a dropout lasts (reads 0)
+"""
+
+block_size = 4096
+
+# substreams
+gaussian, uniform, phases = 0, 1, 2
+
+# sensor channels, each with its own noise column
+channels = ['flow', 'pressure_1', 'pressure_2', 'flow_i', 'flow_e']
+sensors = channels[1:]
+
+# the noise seed of a scenario: s['seed'], or from its title
+def scenario_seed(s):
+    return s.get('seed', zlib.crc32(s['title'].encode()))
+
+def block_generator(seed, substream, block):
+    return np.random.Generator(np.random.Philox(key=[seed, substream]).jumped(block))
+
+# draws for rows start to stop, from draw(generator, shape) per block
+def draws(seed, substream, start, stop, width, draw):
+    first, last = start // block_size, -(-stop // block_size)
+    blocks = [draw(block_generator(seed, substream, block), (block_size, width)) for block in range(first, last)]
+    if not blocks:
+        return np.empty((0, width))
+    offset = first * block_size
+    return np.concatenate(blocks)[start - offset:stop - offset]
+
+def standard_normal(seed, start, stop, width = len(channels)):
+    return draws(seed, gaussian, start, stop, width, lambda g, shape: g.standard_normal(shape))
+
+def uniforms(seed, start, stop, width = len(sensors)):
+    return draws(seed, uniform, start, stop, width, lambda g, shape: g.random(shape))
+
+# flow (l/s) of the cardiac oscillation at times (ms)
+def cardiac(s, time):
+    wave_length = s['heart_rate'] * np.pi * 2 / 60
+    harmonics = s.get('cardiac_harmonics', [1])
+    oscillation = np.sin(time * wave_length / 1000) * harmonics[0]
+    for h, amplitude in enumerate(harmonics[1:], 2):
+        oscillation = oscillation + np.sin(h * time * wave_length / 1000) * amplitude
+    return oscillation * s['cardiac_amplitude']
+
+# slow drift of each sensor at times (ms), (n, sensors)
+def drift(s, seed, time):
+    amplitude = np.array([s.get('pressure_drift', 0)] * 2 + [s.get('flow_drift', 0)] * 2)
+    if not amplitude.any():
+        return None
+    phase = block_generator(seed, phases, 0).uniform(0, 2 * np.pi, len(sensors))
+    period = s.get('drift_period', 300) * 1000
+    return amplitude * np.sin(np.asarray(time, dtype=float)[:, None] * 2 * np.pi / period + phase)
+
+# mask of sensor readings lost to dropouts in rows start to stop, (n, sensors)
+# a dropout starting at row i covers rows i to i + length - 1, so the starts
+# from length - 1 rows before the window are drawn too
+def dropouts(s, seed, start, stop):
+    rate = s.get('dropout_rate', 0)
+    if not rate:
+        return None
+    length = max(1, round(s.get('dropout_length', 1) * 1000 / s['time_resolution'])) # rows
+    first = max(0, start - length + 1)
+    starts = np.cumsum(uniforms(seed, first, stop) < rate, axis=0)
+    starts = np.concatenate([np.zeros((1, len(sensors)), dtype=starts.dtype), starts])
+    rows = np.arange(start, stop) - first + 1 # positions in the cumulative sum
+    return starts[rows] - starts[np.maximum(rows - length, 0)] > 0
+
+def quantize(values, quantum):
+    return np.round(values / quantum) * quantum if quantum else values
+
+# add noisy sensor readings to the simulation dataframe pdf, whose first row
+# is row start of the whole trace
+def decorate(pdf, s, start = 0, seed = None):
+    seed = scenario_seed(s) if seed is None else seed
+    n = len(pdf)
+    noise = standard_normal(seed, start, start + n)
+    pdf['flow'] += noise[:, 0] * s['flow_noise_sd']
+    pdf['flow'] += cardiac(s, pdf['time'])
+    pdf['pressure_1'] = pdf['pressure_mouth'] + noise[:, 1] * s['pressure_noise_sd']
+    pdf['pressure_2'] = pdf['pressure_mouth'] + noise[:, 2] * s['pressure_noise_sd']
+    pdf['flow_i'] = pdf['flow'].clip(lower=0) + noise[:, 3] * s['flow_noise_sd']
+    pdf['flow_e'] = pdf['flow'].clip(upper=0) + noise[:, 4] * s['flow_noise_sd']
+    offsets = drift(s, seed, pdf['time'].to_numpy())
+    quanta = [s.get('pressure_quantum', 0)] * 2 + [s.get('flow_quantum', 0)] * 2
+    lost = dropouts(s, seed, start, start + n)
+    if offsets is None and not any(quanta) and lost is None: # a plain noisy sensor
+        return
+    readings = pdf[sensors].to_numpy(dtype=float)
+    if offsets is not None:
+        readings += offsets
+    for i, column in enumerate(sensors):
+        readings[:, i] = quantize(readings[:, i], quanta[i])
+    if lost is not None:
+        readings[lost] = 0
+    for i, column in enumerate(sensors):
+        pdf[column] = readings[:, i]
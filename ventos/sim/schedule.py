@@ -0,0 +1,65 @@
+import heapq, math
+
+"""
+Event scheduling for the simple simulator.
+
+Scenario events are dicts like dict(attr = 'Pi', val = 15, time = 46) (time in
+seconds). An optional target ('patient' or 'ventilator') says which object the
+attribute is set on, otherwise the ventilator is used if it has the
+attribute, then the patient.
+
+Events are kept in a priority queue keyed on time, so they need not be given
+in order, and the caller's list is never modified.
+"""
+
+# event time in milliseconds
+def event_time(e):
+    return e.get('time', 0) * 1000
+
+# the object an event sets its attribute on
+def event_target(e, patient, ventilator):
+    target = e.get('target')
+    if target == 'patient':
+        return patient
+    if target == 'ventilator':
+        return ventilator
+    if not hasattr(ventilator, e['attr']) and hasattr(patient, e['attr']):
+        return patient
+    return ventilator
+
+class EventScheduler:
+    def __init__(self, events = []):
+        # the sequence number keeps events with equal times in the given order
+        self.queue = [(event_time(e), i, e) for i, e in enumerate(events)]
+        heapq.heapify(self.queue)
+
+    def __len__(self):
+        return len(self.queue)
+
+    def next_time(self):
+        return self.queue[0][0] if self.queue else math.inf
+
+    # remove and return all events due at or before time (ms), in time order
+    def pop_due(self, time):
+        due = []
+        while self.queue and self.queue[0][0] <= time:
+            due.append(heapq.heappop(self.queue)[2])
+        return due
+
+    # split a fixed step run into event-free segments
+    # yields (segment_start, segment_end, events) where the steps
+    # range(segment_start, segment_end, time_resolution) contain no events and
+    # the events are applied after the last of them. An event fires after the
+    # first step whose start time is at or past the event time, as simple.loop
+    # always has. Events after end_time are left in the queue.
+    def segments(self, start_time, end_time, time_resolution):
+        segment_start = start_time
+        while self.queue:
+            steps = max(0, math.ceil((self.next_time() - start_time) / time_resolution))
+            fire_time = start_time + steps * time_resolution
+            if fire_time >= end_time:
+                break
+            yield segment_start, fire_time + time_resolution, self.pop_due(fire_time)
+            segment_start = fire_time + time_resolution
+        if segment_start < end_time:
+            yield segment_start, end_time, []
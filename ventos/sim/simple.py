@@ -1,5 +1,10 @@
-import collections, pandas as pd, numpy as np
+import collections, array, numpy as np
 from ventos.lung import volume_from_pressure, pressure_from_volume
+from ventos.sim.schedule import EventScheduler, event_target
+from ventos import instrument
+from ventos.sim import noise
+# pandas is only imported where dataframes are built (Log.to_frame,
+# df_to_PIRDS), so the models and PIRDS encoding need nothing beyond numpy
 """
 							In men 	In women
 				Vital capacity 	4.8 	3.1 	IRV + TV + ERV
@@ -11,13 +16,97 @@ Patient_log = collections.namedtuple(
     'Patient_log',
     ['time', 'pressure_mouth', 'pressure_alveolus', 'pressure_intrapleural', 'lung_volume', 'flow'])
 
+integer_types = (int, np.integer)
+
+# log of records (namedtuples of type record) held in a typed buffer of
+# doubles rather than a list of tuples, about a fifth of the memory.
+# Columns that only ever receive integers come back as int64 (the others as
+# float64), so to_frame() gives the same dataframe as
+# pd.DataFrame.from_records on the list of records. categories maps fields
+# holding strings to their possible values, eg dict(phase=('E', 'I'))
+class Log:
+    def __init__(self, record, categories = {}):
+        self.record = record
+        self.width = len(record._fields)
+        self.categories = {record._fields.index(field): values for field, values in categories.items()}
+        self.codes = {i: {v: code for code, v in enumerate(values)} for i, values in self.categories.items()}
+        self.clear()
+
+    # empty the log (eg once a chunk has been handed on)
+    def clear(self):
+        self.values = array.array('d')
+        self.integer = list(range(self.width)) # columns only holding integers so far
+
+    def append(self, row):
+        if self.codes:
+            row = [self.codes[i][v] if i in self.codes else v for i, v in enumerate(row)]
+        self.values.fromlist([*row])
+        for i in self.integer:
+            if not isinstance(row[i], integer_types):
+                self.integer = [i for i in self.integer if isinstance(row[i], integer_types)]
+                break
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def __len__(self):
+        return len(self.values) // self.width
+
+    # row i (or a list of the rows in a slice), read straight from the buffer
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('log index out of range')
+        return self.row(self.values[i * self.width:(i + 1) * self.width])
+
+    def row(self, values):
+        values = [int(v) if i in self.integer else v for i, v in enumerate(values)]
+        for i, names in self.categories.items():
+            values[i] = names[values[i]]
+        return self.record(*values)
+
+    # rows as records, building the columns once
+    def __iter__(self):
+        columns = self.columns()
+        return map(self.record._make, zip(*(columns[field].tolist() for field in self.record._fields)))
+
+    # dict of column arrays
+    def columns(self):
+        data = np.frombuffer(self.values, dtype=float).reshape(-1, self.width)
+        columns = {}
+        for i, field in enumerate(self.record._fields):
+            column = data[:, i].astype(np.int64) if i in self.integer else data[:, i].copy()
+            if i in self.categories:
+                column = np.array(self.categories[i], dtype=object)[column]
+            columns[field] = column
+        return columns
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame(self.columns(), columns=list(self.record._fields))
+
+# stands in for a Log when logging is disabled
+class NullLog(list):
+    def append(self, row):
+        pass
+
+    def extend(self, rows):
+        pass
+
 class Patient:
     def __init__(self,
                  height = 175, #cm
                  weight = 70, #kg
                  sex = 'M', # M or other
                  pressure_mouth = 0, #cmH2O
-                 resistance = 10 # cmh2o/l/s or cmh2o per ml/ms
+                 resistance = 10, # cmh2o/l/s or cmh2o per ml/ms
+                 compliance = "Total", # pressure volume curve, see ventos.lung
+                 log = True # keep a Log of every step
                 ):
         self.time = 0 # miliseconds
         self.height = height
@@ -26,12 +115,13 @@ class Patient:
         self.TLC = 6000 if sex == 'M' else 4200 # todo calculate on age, height weight
         self.pressure_mouth = pressure_mouth
         self.resistance = resistance
+        self.compliance = compliance
         self.pressure_alveolus = pressure_mouth # start at equlibrium
-        v_percent = volume_from_pressure(self.pressure_alveolus, 'Total') #assuming no resp effort
+        v_percent = volume_from_pressure(self.pressure_alveolus, compliance) #assuming no resp effort
         self.lung_volume = self.TLC * v_percent / 100
         self.pressure_intrapleural = pressure_from_volume(v_percent, 'Chest')
         self.flow = 0
-        self.log = []
+        self.log = Log(Patient_log) if log else NullLog()
 
     def status(self):
         return Patient_log(self.time, self.pressure_mouth, self.pressure_alveolus, self.pressure_intrapleural, self.lung_volume, self.flow)
@@ -43,7 +133,7 @@ class Patient:
         self.flow = gradient / self.resistance # l/second or ml/ms
         self.lung_volume += self.flow * advance_time
         v_percent = self.lung_volume * 100 / self.TLC
-        self.pressure_alveolus = pressure_from_volume(v_percent, "Total")
+        self.pressure_alveolus = pressure_from_volume(v_percent, self.compliance)
         self.pressure_intrapleural = pressure_from_volume(v_percent, "Chest")
         status = self.status()
         self.log.append(status)
@@ -52,7 +142,7 @@ class Patient:
 
 Ventilator_log = collections.namedtuple('Ventilator_log', ['time', 'phase', 'pressure', 'pressure_mouth'])
 class Ventilator:
-    def __init__(self, mode = "PCV", Pi = 15, PEEP = 5, rate = 10, IE=0.5):
+    def __init__(self, mode = "PCV", Pi = 15, PEEP = 5, rate = 10, IE=0.5, log = True):
         self.pressure = 0
         self.pressure_mouth = 0
         self.mode = mode
@@ -61,7 +151,7 @@ class Ventilator:
         self.rate = rate
         self.IE = IE
         self.phase = "E"
-        self.log = []
+        self.log = Log(Ventilator_log, categories = dict(phase = ('E', 'I'))) if log else NullLog()
         self.time = 0 # miliseconds
 
     def target_pressure(self):
@@ -86,45 +176,126 @@ class Ventilator:
         self.log.append(status)
         return status
 
+# events (see ventos.sim.schedule) are applied after the first step at or
+# past their time; all events due at that step are applied together
+# stats is an optional ventos.instrument.Stats
 def loop(patient, ventilator,
-        start_time = 0, end_time = 20000, time_resolution = 50, events = []):
+        start_time = 0, end_time = 20000, time_resolution = 50, events = [], stats = None):
+    df, = loop_chunks(patient, ventilator, start_time, end_time, time_resolution, events, stats = stats)
+    return df
+
+# as loop, but a generator yielding the log in dataframes of chunk_size rows
+# (the last may be shorter), clearing the patient's and ventilator's logs as
+# it goes so memory use does not grow with the length of the run.
+# Concatenated, the chunks equal the dataframe loop returns (except that a
+# column holding only integers within a chunk is int64 in that chunk).
+# Without a chunk_size the whole run is yielded as one dataframe and the
+# logs are kept, as loop does
+def loop_chunks(patient, ventilator,
+        start_time = 0, end_time = 20000, time_resolution = 50, events = [], chunk_size = None, stats = None):
+    stats = stats or instrument.null
     # print('starting', patient.status())
     patient_status = patient.advance(advance_time = 0)
     # print('vent starting', ventilator.status())
-    for current_time in range(start_time, end_time, time_resolution):
-        ventilator_status = ventilator.advance(advance_time = time_resolution, pressure_mouth = patient_status.pressure_mouth)
-        patient_status = patient.advance(advance_time = time_resolution, pressure_mouth = ventilator_status.pressure_mouth)
-        if len(events) and events[0]['time']*1000 <= current_time:
-            e = events.pop(0)
+    # the bound methods are only wrapped when instrumenting
+    ventilator_advance = stats.timed('loop.ventilator', ventilator.advance)
+    patient_advance = stats.timed('loop.patient', patient.advance)
+    def chunk():
+        with stats.stage('loop.dataframe'):
+            df = patient.log.to_frame()
+        if chunk_size:
+            patient.log.clear()
+            ventilator.log.clear()
+        return df
+    rows = len(patient.log)
+    chunks = 0
+    schedule = EventScheduler(events)
+    for segment_start, segment_end, due in schedule.segments(start_time, end_time, time_resolution):
+        for current_time in range(segment_start, segment_end, time_resolution):
+            ventilator_status = ventilator_advance(advance_time = time_resolution, pressure_mouth = patient_status.pressure_mouth)
+            patient_status = patient_advance(advance_time = time_resolution, pressure_mouth = ventilator_status.pressure_mouth)
+            if chunk_size:
+                rows += 1
+                if rows >= chunk_size:
+                    yield chunk()
+                    rows, chunks = 0, chunks + 1
+        for e in due:
             print(f'Event at {current_time}ms setting {e["attr"]} to {e["val"]}')
-            setattr(ventilator, e["attr"], e["val"])
-    df = pd.DataFrame.from_records(patient.log, columns=Patient_log._fields)
-    if len(events):
-        print(f'WARNING {len(events)} unprocessed')
-    return df
+            setattr(event_target(e, patient, ventilator), e["attr"], e["val"])
+    if rows or not chunks:
+        yield chunk()
+    if len(schedule):
+        print(f'WARNING {len(schedule)} unprocessed')
 
 ## take a raw simple simulation and add noise sensor readers that match the sim
-def decorate_sim(pdf, s):
-    pdf['flow'] += np.random.normal(0, s['flow_noise_sd'], len(pdf))
-    wave_length = s['heart_rate'] * np.pi * 2 / 60
-    pdf['flow'] += np.sin(pdf['time'] * wave_length / 1000) * s['cardiac_amplitude']
-    pdf['pressure_1'] = pdf['pressure_mouth'] + np.random.normal(0, s['pressure_noise_sd'], len(pdf)) #
-    pdf['pressure_2'] = pdf['pressure_mouth'] + np.random.normal(0, s['pressure_noise_sd'], len(pdf)) #
-    pdf['flow_i'] = pdf['flow'].clip(lower=0) + np.random.normal(0, s['flow_noise_sd'], len(pdf))
-    pdf['flow_e'] = pdf['flow'].clip(upper=0) + np.random.normal(0, s['flow_noise_sd'], len(pdf))
+# the noise (see ventos.sim.noise) is seeded by s['seed'] (or the title) and
+# start is the row of the whole trace that pdf starts at, so a trace
+# decorated in chunks is identical to one decorated in one go
+def decorate_sim(pdf, s, start = 0):
+    noise.decorate(pdf, s, start)
 
 
+# patient and ventilator for a scenario (s)
+# s['patient'] selects the 'simple' patient (default) or the 'collapsible'
+# airway patient of ventos.sim.collapsible
+def scenario_models(s, ventilator_log = True):
+    if s.get('patient', 'simple') == 'collapsible':
+        from ventos.sim.collapsible import CollapsiblePatient # imported here as it builds on this module
+        p = CollapsiblePatient(resistance=s['resistance'], pressure_mouth=s['PEEP'], Pmus=s.get('Pmus', 0))
+    else:
+        p = Patient(resistance=s['resistance'], pressure_mouth=s['PEEP'], compliance=s.get('compliance', 'Total'))
+    v = Ventilator(PEEP=s['PEEP'], rate=s['rate'], IE=s['IE'], Pi = s['Pi'], log = ventilator_log)
+    return p, v
+
 # excecute a scenario (s)
+# s['integrator'] selects the fixed step 'euler' loop (default) or the
+# 'adaptive' step integrator of ventos.sim.adaptive (simple patients only)
+# stats is an optional ventos.instrument.Stats
 # returns a dataframe
-def execute_scenario(s):
-    p = Patient(resistance=s['resistance'], pressure_mouth=s['PEEP'])
-    v = Ventilator(PEEP=s['PEEP'], rate=s['rate'], IE=s['IE'], Pi = s['Pi'])
-    pdf = loop(p, v,
-              end_time = s['end_time'] * 1000, time_resolution=s['time_resolution'],
-             events = s['events'])
-    decorate_sim(pdf, s)
+def execute_scenario(s, stats = None):
+    stats = stats or instrument.null
+    with stats.stage('execute_scenario.setup'):
+        p, v = scenario_models(s)
+    with stats.stage('execute_scenario.loop'):
+        if s.get('integrator', 'euler') == 'adaptive':
+            pdf = adaptive_loop(p, v, s, stats)
+        else:
+            pdf = loop(p, v,
+                  end_time = s['end_time'] * 1000, time_resolution=s['time_resolution'],
+                 events = s['events'], stats = stats)
+    with stats.stage('execute_scenario.decorate_sim'):
+        decorate_sim(pdf, s)
     return pdf
 
+def adaptive_loop(p, v, s, stats = None):
+    if not isinstance(p, Patient):
+        raise ValueError('the adaptive integrator only supports the simple patient')
+    from ventos.sim import adaptive # imported here as it builds on this module
+    return adaptive.loop(p, v,
+          end_time = s['end_time'] * 1000, time_resolution=s['time_resolution'],
+          events = s['events'], rtol = s.get('rtol', 1e-6), atol = s.get('atol', 1e-6), stats = stats)
+
+# as execute_scenario, but a generator of decorated dataframes of chunk_size
+# rows (see loop_chunks), for runs too long to hold in memory. Concatenated
+# they equal execute_scenario's result. The adaptive integrator runs the
+# whole scenario and then yields it in chunks
+def execute_scenario_chunks(s, chunk_size = 10000, stats = None):
+    stats = stats or instrument.null
+    p, v = scenario_models(s, ventilator_log = False)
+    if s.get('integrator', 'euler') == 'adaptive':
+        pdf = adaptive_loop(p, v, s, stats)
+        chunks = (pdf.iloc[i:i + chunk_size].reset_index(drop=True) for i in range(0, len(pdf), chunk_size))
+    else:
+        chunks = loop_chunks(p, v,
+              end_time = s['end_time'] * 1000, time_resolution=s['time_resolution'],
+              events = s['events'], chunk_size = chunk_size, stats = stats)
+    start = 0
+    for pdf in chunks:
+        with stats.stage('execute_scenario.decorate_sim'):
+            decorate_sim(pdf, s, start)
+        start += len(pdf)
+        yield pdf
+
 """
 Creating a PIRDS JSON file.
 
@@ -145,20 +316,59 @@ The Types are:
 
 litres_per_second_to_ml_per_minute = 60*1000
 
+# the four PIRDS measurements written for each simulated sample, in order:
+# (type, loc, column, scale)
+PIRDS_channels = [("P", "I", "pressure_1", 1),
+                  ("P", "E", "pressure_2", 1),
+                  ("F", "I", "flow_i", litres_per_second_to_ml_per_minute),
+                  ("F", "E", "flow_e", litres_per_second_to_ml_per_minute)]
+
+# column-wise conversion of a simulation to PIRDS values
+# returns ms (n,) and val (n, 4) integer arrays, channels as in PIRDS_channels
+def PIRDS_arrays(df):
+    ms = df['time'].to_numpy().astype(int)
+    val = np.empty((len(df), len(PIRDS_channels)), dtype=int)
+    for i, (type, loc, column, scale) in enumerate(PIRDS_channels):
+        val[:, i] = np.round(df[column].to_numpy(dtype=float) * scale)
+    return ms, val
+
 def df_to_PIRDS(df):
-    pirds = []
-    for index, r in df.iterrows():
-        pirds.append({"event": "M",
-                      "type": "P", "loc":"I",
-                      "ms": int(r.time), "val": int(round(r.pressure_1))})
-        pirds.append({"event": "M",
-                      "type": "P", "loc":"E",
-                      "ms": int(r.time), "val": int(round(r.pressure_2))})
-        pirds.append({"event": "M",
-                      "type": "F", "loc":"I",
-                      "ms": int(r.time), "val": int(round(r.flow_i * litres_per_second_to_ml_per_minute))})
-        pirds.append({"event": "M",
-                      "type": "F", "loc":"E",
-                      "ms": int(r.time), "val": int(round(r.flow_e * litres_per_second_to_ml_per_minute))})
-    return pd.DataFrame.from_records(pirds)
+    import pandas as pd
+    ms, val = PIRDS_arrays(df)
+    n = len(PIRDS_channels)
+    return pd.DataFrame({"event": "M",
+                         "type": [c[0] for c in PIRDS_channels] * len(df),
+                         "loc": [c[1] for c in PIRDS_channels] * len(df),
+                         "ms": np.repeat(ms, n),
+                         "val": val.reshape(-1)})
+
+PIRDS_formats = {
+    "json": ('', '{"event":"M","type":"%s","loc":"%s","ms":%d,"val":%d}'),
+    "csv": ('event,type,loc,ms,val\n', 'M,%s,%s,%d,%d')}
+
+# stream a simulation to an open file handle as PIRDS JSON-lines or CSV
+# records are formatted chunk_size samples at a time, so the full record list
+# is never held in memory. Output matches writing df_to_PIRDS(df) with
+# to_json(orient="records", lines=True) (without a final newline, as in the
+# committed test_traces) or to_csv(index=False)
+def write_PIRDS(df, handle, format = "json", chunk_size = 10000, first = True):
+    header, record = PIRDS_formats[format]
+    if first:
+        handle.write(header)
+    ms, val = PIRDS_arrays(df)
+    labels = [(c[0], c[1]) for c in PIRDS_channels]
+    for start in range(0, len(df), chunk_size):
+        lines = [record % (type, loc, m, v)
+                 for m, vs in zip(ms[start:start + chunk_size].tolist(), val[start:start + chunk_size].tolist())
+                 for (type, loc), v in zip(labels, vs)]
+        if format == "csv":
+            lines.append('')
+        elif not first:
+            lines.insert(0, '')
+        handle.write('\n'.join(lines))
+        first = False
 
+# write dataframe chunks (eg from execute_scenario_chunks) as one PIRDS file
+def write_PIRDS_chunks(chunks, handle, format = "json", chunk_size = 10000):
+    for i, df in enumerate(chunks):
+        write_PIRDS(df, handle, format, chunk_size, first = i == 0)
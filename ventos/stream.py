@@ -0,0 +1,117 @@
+#!/usr/bin/env python3.7
+import sys
+import os.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import ventos # first, see ventos/__init__.py
+import json, argparse, collections, itertools
+from dataclasses import asdict
+from ventos import signal
+
+"""
+Online version of signal.process_trace.
+
+Consumes PIRDS measurement records (as written by simple.df_to_PIRDS), one at
+a time or in small batches, and returns breath events and status updates.
+Only the VentilatorStatus and a short window of recent samples are kept, so
+memory use does not grow with the length of the run.
+
+From the command line it reads PIRDS JSON-lines on stdin and writes events as
+JSON-lines on stdout, eg:
+
+    ventos/stream.py --status < test_traces/Wimpy_20x240.pirds.json
+"""
+
+class TraceStream:
+    # resample averages each detector period of samples (signal.Resampler)
+    # rather than keeping the first sample of each
+    def __init__(self, config = None, type = "P", loc = "I", status = False, window = 100, resample = False):
+        self.config = config or signal.VentilatorConfig()
+        self.type = type # PIRDS measurement type and location to monitor
+        self.loc = loc
+        self.status = status # emit a status update for every processed sample
+        self.state = signal.VentilatorStatus()
+        self.next_time = -1 # ms, decimation threshold as in process_trace
+        self.recent = collections.deque(maxlen=window) # (ms, pressure) of recent processed samples
+        self.resampler = signal.Resampler(self.config.sample_frequency) if resample else None
+
+    # process one PIRDS record (a dict or a JSON string), returning a list of events
+    def feed(self, record):
+        return self.feed_batch([record])
+
+    # process a batch of PIRDS records, returning a list of event dicts
+    def feed_batch(self, records):
+        minimum_time_gap = 1000 / self.config.sample_frequency
+        times, pressures = [], []
+        for r in records:
+            if isinstance(r, str):
+                r = json.loads(r)
+            if r.get("event") != "M" or r.get("type") != self.type or r.get("loc") != self.loc:
+                continue
+            if self.resampler:
+                times.append(r["ms"])
+                pressures.append(r["val"])
+            elif r["ms"] > self.next_time:
+                times.append(r["ms"])
+                pressures.append(r["val"])
+                self.next_time += minimum_time_gap
+        if self.resampler: # detector periods completed by this batch
+            times, pressures = (values.tolist() for values in self.resampler.feed(times, pressures))
+        return self.detect(times, pressures)
+
+    # process what is still buffered at the end of the stream (the last
+    # detector period when resampling), returning a list of events
+    def flush(self):
+        if not self.resampler:
+            return []
+        times, pressures = (values.tolist() for values in self.resampler.flush())
+        return self.detect(times, pressures)
+
+    # run the detector over decimated samples, returning events
+    def detect(self, times, pressures):
+        if not times:
+            return []
+        events = []
+        inhaling = self.state.inhaling
+        columns = signal.step_arrays(self.config, pressures, self.state)
+        self.recent.extend(zip(times, pressures))
+        for i, ms in enumerate(times):
+            if self.status:
+                events.append(dict(event="status", ms=ms, **{field: values[i] for field, values in columns.items()}))
+            if inhaling and not columns['inhaling'][i]: # end of inspiration completes a breath
+                events.append(dict(event="breath", ms=ms,
+                                   PIP=columns['PIP'][i], PEEP=columns['PEEP'][i], RR=columns['RR'][i]))
+            inhaling = columns['inhaling'][i]
+        return events
+
+    # process an iterable of records in batches of batch_size, yielding the
+    # events of each batch as it is processed, then those of flush() once the
+    # records run out
+    def process(self, records, batch_size = 20):
+        records = iter(records)
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                yield from self.flush()
+                return
+            yield from self.feed_batch(batch)
+
+    def status_dict(self):
+        return asdict(self.state)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='breath detection on a PIRDS JSON-lines stream read from stdin')
+    parser.add_argument('--frequency', type=float, default=10, help='detector sample rate (Hz)')
+    parser.add_argument('--type', default='P', help='PIRDS measurement type to monitor')
+    parser.add_argument('--loc', default='I', help='PIRDS measurement location to monitor')
+    parser.add_argument('--status', action='store_true', help='also write a status update for every sample')
+    parser.add_argument('--batch', type=int, default=20, help='records read per batch')
+    parser.add_argument('--resample', action='store_true', help='average each detector period (for fast sensors)')
+    args = parser.parse_args(argv)
+    stream = TraceStream(signal.VentilatorConfig(sample_frequency=args.frequency),
+                         type=args.type, loc=args.loc, status=args.status, resample=args.resample)
+    lines = (line for line in sys.stdin if line.strip())
+    for event in stream.process(lines, batch_size=args.batch):
+        print(json.dumps(event), flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3.7
+import sys
+import os.path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import ventos # first, see ventos/__init__.py
+import json, hashlib, itertools, argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np, pandas as pd
+from ventos.sim import simple
+from ventos import test_trace
+
+"""
+Parameter sweeps with on-disk memoization.
+
+A sweep expands a grid of settings around a base scenario (by default
+test_trace.base_scenario) into scenarios, simulates them in parallel with
+simple.execute_scenario and returns the resulting dataframes:
+
+    results = sweep.run(dict(resistance=[10, 20, 40], PEEP=[5, 10], Pi=[15, 25]))
+    for scenario, df in results.values():
+        ...
+
+Each result is cached on disk, keyed by a canonical hash of the scenario, the
+noise seed and the simulator source (test_trace.code_version), as a .npz file
+holding one array per column. Repeated or overlapping sweeps only simulate
+the new points. The cache is bounded in size: when it grows past max_bytes
+the least recently used results are removed.
+"""
+
+default_cache = os.path.join(os.path.expanduser('~'), '.cache', 'ventos', 'sweep')
+default_max_bytes = 1 << 30
+
+# scenarios for every combination of the values in axes (dict of setting:
+# list of values), titled by their settings
+def grid(axes, base = None):
+    base = dict(test_trace.base_scenario if base is None else base, events = [])
+    names = list(axes)
+    scenarios = []
+    for values in itertools.product(*(axes[name] for name in names)):
+        settings = dict(zip(names, values))
+        title = ' '.join(f'{name}={value}' for name, value in settings.items())
+        scenarios.append(dict(base, title = title or base['title'], **settings))
+    return scenarios
+
+# canonical hash of everything that determines a simulation result
+def result_key(scenario, seed, code):
+    content = json.dumps(dict(scenario=scenario, seed=seed, code=code), sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+class Cache:
+    def __init__(self, path = default_cache, max_bytes = default_max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def filename(self, key):
+        return os.path.join(self.path, f'{key}.npz')
+
+    def __contains__(self, key):
+        return os.path.exists(self.filename(key))
+
+    # the cached dataframe, marking it as recently used, or None
+    def get(self, key):
+        filename = self.filename(key)
+        try:
+            with np.load(filename) as data:
+                df = pd.DataFrame({column: data[column] for column in data.files})
+        except FileNotFoundError:
+            return None
+        os.utime(filename)
+        return df
+
+    def put(self, key, df):
+        filename = self.filename(key)
+        temporary = f'{filename}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as f: # written then renamed, so readers never see part of a file
+            np.savez(f, **{column: df[column].to_numpy() for column in df.columns})
+        os.replace(temporary, filename)
+
+    # remove least recently used results until the cache fits in max_bytes
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.npz'):
+                stat = os.stat(os.path.join(self.path, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.path, name))
+            total -= size
+
+# process pool entry point: simulate one scenario into the cache
+def simulate(scenario, seed, key, path):
+    Cache(path).put(key, simple.execute_scenario(dict(scenario, seed = seed)))
+    return key
+
+# run a sweep, given axes (see grid) or a list of scenarios, returning a dict
+# of result_key: (scenario, dataframe) in the order of the scenarios, so
+# scenarios that share a title are kept apart and identical ones share an
+# entry. Each scenario's noise is seeded by test_trace.scenario_seed, so
+# results do not depend on which points were already cached. workers defaults
+# to the number of CPUs
+def run(axes, base = None, cache = None, workers = None):
+    scenarios = grid(axes, base) if isinstance(axes, dict) else axes
+    cache = cache or Cache()
+    code = test_trace.code_version()
+    keys = {}
+    for s in scenarios:
+        seed = test_trace.scenario_seed(s)
+        key = result_key(s, seed, code)
+        keys.setdefault(key, (s, seed))
+    missing = {key: (s, seed) for key, (s, seed) in keys.items() if key not in cache}
+    print(f'{len(missing)} of {len(keys)} sweep points to simulate')
+    workers = workers or os.cpu_count()
+    if workers <= 1 or len(missing) <= 1:
+        for key, (s, seed) in missing.items():
+            simulate(s, seed, key, cache.path)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(simulate, *zip(*((s, seed, key, cache.path) for key, (s, seed) in missing.items()))))
+    results = {key: (s, cache.get(key)) for key, (s, seed) in keys.items()}
+    cache.evict() # after reading, so this sweep's results are the most recently used
+    return results
+
+# parse a comma separated list of numbers, keeping integers as int
+def values(text):
+    return [float(v) if '.' in v else int(v) for v in text.split(',')]
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='simulate a grid of scenarios around the base scenario')
+    for setting in ['resistance', 'PEEP', 'Pi', 'rate', 'IE']:
+        parser.add_argument(f'--{setting}', type=values, help=f'comma separated values of {setting}')
+    parser.add_argument('--end-time', type=int, help='seconds to simulate')
+    parser.add_argument('--cache', default=default_cache)
+    parser.add_argument('--max-bytes', type=int, default=default_max_bytes, help='cache size limit')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    args = parser.parse_args(argv)
+    axes = {setting: getattr(args, setting) for setting in ['resistance', 'PEEP', 'Pi', 'rate', 'IE']
+            if getattr(args, setting)}
+    base = dict(test_trace.base_scenario)
+    if args.end_time:
+        base['end_time'] = args.end_time
+    results = run(axes, base, Cache(args.cache, args.max_bytes), args.workers)
+    for s, df in results.values():
+        print(f"{s['title']}: {len(df)} samples, pressure_1 {df['pressure_1'].min():.1f} to {df['pressure_1'].max():.1f}")
+
+if __name__ == "__main__":
+    main()
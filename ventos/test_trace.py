@@ -1,42 +1,28 @@
 #!/usr/bin/env python3.7
 import sys
-import matplotlib, json
-import pandas as pd, matplotlib.pyplot as plt
-from datetime import datetime
-from pprint import pprint
 import os.path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
-from ventos.sim import simple
+import ventos # first, see ventos/__init__.py
+import json, hashlib, glob, argparse
+from datetime import datetime
+from pprint import pprint
+from ventos.sim import simple, noise
+from ventos import columnar, instrument, render
 
+# matplotlib is only imported when plotting, so that checking which traces
+# need rebuilding stays fast
+# draws on a new pyplot figure (to show), each series decimated to the plot width
 def vent_plots(pdf, title):
-    fig, plots = plt.subplots(3, sharex=True) # , gridspec_kw={'hspace': 0}
-    (ax1, ax2, ax3) = plots
-    for ax in plots:
-        ax.spines['top'].set_visible(False)
-        ax.spines['bottom'].set_visible(False)
-        ax.spines['right'].set_visible(False)
-    plots[-1].spines['bottom'].set_visible(True)
-
-    fig.suptitle(title)
-    ax1.plot(pdf['time'] / 1000, pdf['flow'], 'dimgray')
-    ax1.plot(pdf['time'] / 1000, pdf['flow_i'], 'tab:orange')
-    ax1.plot(pdf['time'] / 1000, pdf['flow_e'], 'tab:blue')
-
-    ax1.set(ylabel = 'Flow (l/s)')
-    ax2.plot(pdf['time'] / 1000, pdf['pressure_mouth'], 'dimgray')
-    ax2.plot(pdf['time'] / 1000, pdf['pressure_1'], 'tab:green')
-    ax2.plot(pdf['time'] / 1000, pdf['pressure_2'], 'tab:green')
-
-    ax2.set(ylabel = 'P (cmH2O)')
-    ax3.plot(pdf['time'] / 1000, pdf['lung_volume'], 'tab:orange')
-    ax3.set(ylabel = 'Volume (ml)', xlabel = 'time (seconds)')
-    ax1.label_outer()
-    ax2.label_outer()
+    import matplotlib.pyplot as plt
+    renderer = render.Renderer(figure=plt.figure())
+    renderer.draw(pdf, title)
+    return renderer.figure
 
 def run_and_output(scenario):
     pprint(scenario)
     pdf = simple.execute_scenario(scenario)
     vent_plots(pdf, title=scenario['title'])
+    import matplotlib.pyplot as plt
     plt.show()
     return pdf
 
@@ -123,7 +109,8 @@ def scenarios(badnesses=badnesses,
         return unwind_badness(current_events,  new_events, unwind_at, base) if unwind_at else current_events
     # loop over daranged attributes and restore them
     def unwind_badness(current_events, badness, offset, base):
-        for deranged in set([b['attr'] for b in badness]):
+        # dict.fromkeys rather than set, so the order does not vary between processes
+        for deranged in dict.fromkeys([b['attr'] for b in badness]):
             current_events.append(dict(attr = deranged, val=base[deranged], time=offset))
         return current_events
     base = dict(base_scenario, time_resolution = round(1000/sample_frequency))
@@ -148,24 +135,45 @@ def make_not_pirds(df):
     d['FE'] *= simple.litres_per_second_to_ml_per_minute
     return d.astype(int)
 
-def update_files(scenario, path, pirds = False, csv = False, not_pirds= False, plot = False):
-    #pprint(scenario)
+def file_stem(scenario, path):
     name = f"""{scenario['title'].title().replace(' ', '')}_{
          round(1000/scenario['time_resolution'])}x{scenario['end_time']}"""
-    filestem = os.path.join(path, name)
+    return os.path.join(path, name)
+
+# files written by update_files for the given options
+def output_files(scenario, path, pirds = False, csv = False, not_pirds= False, plot = False, binary = False):
+    filestem = file_stem(scenario, path)
+    suffixes = [('.pirds.json', pirds), ('.pirds.csv', csv), ('.csv', not_pirds), ('.png', plot), ('.trace.npy', binary)]
+    return [f"{filestem}{suffix}" for suffix, wanted in suffixes if wanted]
+
+# seed (default scenario_seed) seeds the noise added to the trace
+# binary writes the compact columnar format of ventos.columnar
+# stats is an optional ventos.instrument.Stats
+def update_files(scenario, path, pirds = False, csv = False, not_pirds= False, plot = False, binary = False, seed = None,
+                 stats = None):
+    stats = stats or instrument.null
+    #pprint(scenario)
+    filestem = file_stem(scenario, path)
     print(f'name stem: {filestem}')
-    pdf = simple.execute_scenario(scenario)
-    if pirds or csv:
-        pirds_df = simple.df_to_PIRDS(pdf)
+    if seed is not None:
+        scenario = dict(scenario, seed = seed)
+    with stats.stage('update_files.simulate'):
+        pdf = simple.execute_scenario(scenario, stats = stats)
     if pirds:
-        pirds_df.to_json(f"{filestem}.pirds.json", orient="records",lines=True)
+        with stats.stage('update_files.pirds'), open(f"{filestem}.pirds.json", "w") as handle:
+            simple.write_PIRDS(pdf, handle, format="json")
     if csv:
-        pirds_df.to_csv(f"{filestem}.pirds.csv", index=False)
+        with stats.stage('update_files.csv'), open(f"{filestem}.pirds.csv", "w") as handle:
+            simple.write_PIRDS(pdf, handle, format="csv")
     if not_pirds:
-        make_not_pirds(pdf).to_csv(f"{filestem}.csv", index=False)
+        with stats.stage('update_files.not_pirds'):
+            make_not_pirds(pdf).to_csv(f"{filestem}.csv", index=False)
+    if binary:
+        with stats.stage('update_files.binary'):
+            columnar.write(pdf, f"{filestem}.trace.npy")
     if plot:
-        vent_plots(pdf, title=scenario['title'])
-        plt.savefig(f"{filestem}.png")
+        with stats.stage('update_files.plot'):
+            render.save(pdf, scenario['title'], f"{filestem}.png")
 
 def run_all():
     for s in scenarios()[:0]:
@@ -174,13 +182,90 @@ def run_all():
 def sys_info():
     return f'python {sys.version.split(" ")[0]} at {datetime.now()} in {os.getcwd()}'
 
-def main():
-    # pprint(scenarios()[:2])
-    path = os.path.join(os.getcwd(),'test_traces')
+# default noise seed for a scenario, stable across runs and processes
+def scenario_seed(scenario):
+    return noise.scenario_seed(scenario)
+
+# hash of the source files that determine the content of a trace: every
+# simulator module, the models and formats they use, and this script
+def code_version():
+    here = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    sim = sorted(os.path.relpath(f, here) for f in glob.glob(os.path.join(here, 'sim', '*.py')))
+    for source in sim + ['lung.py', 'model.py', 'columnar.py', 'render.py', 'test_trace.py']:
+        digest.update(source.encode())
+        with open(os.path.join(here, source), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+# content hash of everything that goes into a scenario's files
+def scenario_hash(scenario, seed, outputs, code):
+    content = json.dumps(dict(scenario=scenario, seed=seed, outputs=outputs, code=code),
+                         sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def load_manifest(path):
+    try:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_manifest(path, manifest):
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+# process pool entry point, returns the title and (if profiling) the stats as a dict
+# profile is None, or 'time' or 'memory' to also record allocated bytes
+def build(scenario, path, outputs, seed, profile = None):
+    print(f"################## {scenario['title']} {round(1000/scenario['time_resolution'])}Hz for {scenario['end_time']}s")
+    stats = instrument.Stats(memory = profile == 'memory') if profile else None
+    update_files(scenario, path, seed=seed, stats=stats, **outputs)
+    if stats:
+        stats.close()
+    return scenario['title'], stats.as_dict() if stats else {}
+
+# regenerate the test traces, rebuilding only scenarios whose manifest hash
+# is out of date (or whose files are missing), workers at a time
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='regenerate the test trace files')
+    parser.add_argument('--path', default=os.path.join(os.getcwd(),'test_traces'))
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--force', action='store_true', help='rebuild every scenario')
+    parser.add_argument('--binary', action='store_true', help='also write .trace.npy columnar files')
+    parser.add_argument('--stats', help='write per stage timings of the rebuilt scenarios to this JSON file')
+    parser.add_argument('--memory', action='store_true', help='include allocated bytes in --stats (slow)')
+    args = parser.parse_args(argv)
+    profile = ('memory' if args.memory else 'time') if args.stats else None
+    outputs = dict(pirds=True, csv=False, not_pirds=False, plot=True, binary=args.binary)
+    manifest = load_manifest(args.path)
+    code = code_version()
+    jobs = {}
     for title, s in scenarios(badnesses).items():
-        print(f"################## {title} {round(1000/s['time_resolution'])}Hz for {s['end_time']}s")
-        #pprint(s)
-        update_files(s, path, pirds=True, csv=False, not_pirds=False, plot=True)
+        seed = scenario_seed(s)
+        key = scenario_hash(s, seed, outputs, code)
+        current = manifest.get(title) == key and all(map(os.path.exists, output_files(s, args.path, **outputs)))
+        if args.force or not current:
+            jobs[title] = (s, seed, key)
+    print(f'{len(jobs)} of {len(scenarios(badnesses))} scenarios to rebuild')
+    stats = instrument.Stats(memory = args.memory, trace = False) # totals of the builds, which trace their own
+    if args.workers <= 1:
+        for title, (s, seed, key) in jobs.items():
+            stats.merge(build(s, args.path, outputs, seed, profile)[1])
+            manifest[title] = key
+            save_manifest(args.path, manifest)
+    elif jobs:
+        from concurrent.futures import ProcessPoolExecutor, as_completed # only the parallel rebuild needs it
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = [pool.submit(build, s, args.path, outputs, seed, profile) for s, seed, key in jobs.values()]
+            for future in as_completed(futures):
+                title, build_stats = future.result()
+                stats.merge(build_stats)
+                manifest[title] = jobs[title][2]
+                save_manifest(args.path, manifest)
+    if args.stats:
+        print(stats.report())
+        stats.dump(args.stats)
 
 if __name__ == "__main__":
     print("starting", sys_info())